@@ -0,0 +1,348 @@
+"""
+Archive databases for old tweets.
+
+   python archive.py move <database> --before 2021-01-01 [--period year|month] [--vacuum]
+   python archive.py list <database>
+
+move takes every conversation whose tweets and retweets all date from before
+the cutoff, and moves its tweets, their retweets and mentions out of the main
+database into one file per period (<database name>-<period>.db beside it),
+chosen by the date of the conversation's first tweet. Conversations stay
+whole, so replies and the thread view keep working inside an archive. A later
+reply to an archived tweet starts a conversation of its own in the main
+database, which thread() shows below the archived tweets it answers. Tweet
+and retweet counters keep including archived rows, and hashtag trend buckets
+are left as they are.
+
+The read functions here take the same arguments as their queries
+counterparts. They read the main database first and attach archive files,
+newest first, only once a page reaches back past the cutoff:
+
+    archive.user_tweets_page(conn, usr, after)
+    archive.search_tweets_page(conn, keywords, after, before)
+    archive.thread(conn, tid)
+
+Archives are attached to the caller's connection, which must not be inside a
+transaction at the time.
+"""
+
+import argparse
+import calendar
+import os
+import time
+
+import queries
+import schema
+
+PERIODS = {'year': '%Y', 'month': '%Y-%m'}
+MAX_ATTACHED = 8  # SQLite allows 10 attached databases unless built otherwise
+
+ARCHIVE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS {db}.tweets (
+    tid INTEGER PRIMARY KEY,
+    writer INT,
+    tdate DATE,
+    text TEXT,
+    replyto INT,
+    root INT,
+    depth INT,
+    tdate_ms INT
+);
+
+CREATE INDEX IF NOT EXISTS {db}.tweets_writer_ms_idx ON tweets (writer, tdate_ms, tid);
+
+CREATE INDEX IF NOT EXISTS {db}.tweets_root_idx ON tweets (root, tid);
+
+CREATE TABLE IF NOT EXISTS {db}.retweets (
+    usr INT,
+    tid INT,
+    rdate DATE,
+    rdate_ms INT,
+    PRIMARY KEY (usr, tid)
+);
+
+CREATE TABLE IF NOT EXISTS {db}.mentions (
+    tid INT,
+    term TEXT,
+    PRIMARY KEY (tid, term)
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS {db}.tweets_fts USING fts5(text, terms);
+'''
+
+
+def cutoff(conn):
+    # In milliseconds, like the dates in page keys
+    row = conn.execute("SELECT value FROM meta WHERE key = 'archive_cutoff'").fetchone()
+    return row[0] if row else None
+
+
+def archives(conn):
+    # [(period, path, first_ms, last_ms)], newest first
+    return conn.execute('''
+        SELECT period, path, first_ms, last_ms FROM archives
+        WHERE first_ms IS NOT NULL
+        ORDER BY last_ms DESC
+    ''').fetchall()
+
+
+def main_file(conn):
+    return [row[2] for row in conn.execute('PRAGMA database_list') if row[1] == 'main'][0]
+
+
+def attach(conn, period, path):
+    # Attaches the archive for period unless it already is; returns its schema
+    # name. Attaching writes nothing, so read-only connections can use it too.
+    name = 'archive_' + period.replace('-', '_')
+    attached = [row[1] for row in conn.execute('PRAGMA database_list')]
+    if name not in attached:
+        archived = [other for other in attached if other.startswith('archive_')]
+        if len(archived) >= MAX_ATTACHED:
+            conn.execute(f'DETACH DATABASE {archived[0]}')
+        conn.execute(f'ATTACH DATABASE ? AS {name}', (os.path.join(os.path.dirname(main_file(conn)), path),))
+    return name
+
+
+def prepare(conn, db):
+    # Creates the schema of a new archive, or brings one written before the
+    # millisecond columns up to date, in one write transaction of its own
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        schema.fill_archive_epochs(conn, db)
+        schema.run_script(conn, ARCHIVE_SCHEMA.format(db=db))
+
+
+def merged_page(conn, fetch, after, before, limit):
+    # fetch(db, after, before, limit) reads one newest-first keyset page of
+    # (tid, ..., tdate_ms, ...) rows from one database; rows here have the date at
+    # index 2. Archives only hold tweets from before the cutoff, so they are read
+    # only when the main database's page reaches back past it.
+    rows = fetch('main', after, before, limit)
+    edge = cutoff(conn)
+    if edge is None:
+        return rows
+    if before is None and len(rows) == limit and rows[-1][2] >= edge:
+        return rows
+    if before is not None and before[0] >= edge:
+        return rows
+
+    def key(row):
+        return row[2], row[0]
+
+    for period, path, first_ms, last_ms in archives(conn):
+        if after is not None and first_ms > after[0]:
+            continue
+        if before is not None and last_ms < before[0]:
+            continue
+        if before is None and len(rows) >= limit and sorted(map(key, rows), reverse=True)[limit - 1][0] > last_ms:
+            break  # this and every older archive is past the end of the page
+        rows += fetch(attach(conn, period, path), after, before, limit)
+    if before is None:
+        return sorted(rows, key=key, reverse=True)[:limit]
+    return sorted(rows, key=key)[:limit][::-1]
+
+
+def user_tweets_page(conn, usr, after=None, before=None, limit=5):
+    return merged_page(conn, lambda db, after, before, limit:
+                       queries.user_tweets_page(conn, usr, after, before, limit, db), after, before, limit)
+
+
+def search_tweets_page(conn, keywords, after=None, before=None, limit=5):
+    return merged_page(conn, lambda db, after, before, limit:
+                       queries.search_tweets_page(conn, keywords, after, before, limit, db), after, before, limit)
+
+
+def thread(conn, tid):
+    if cutoff(conn) is None:
+        return queries.thread(conn, tid)
+    rows, db = queries.thread(conn, tid), 'main'
+    if not rows:
+        for period, path, first_ms, last_ms in archives(conn):
+            db = attach(conn, period, path)
+            rows = queries.thread(conn, tid, db)
+            if rows:
+                break
+        else:
+            return []
+    # A reply to a tweet that was already archived starts a conversation of its
+    # own; the tweets it answers are put back in front of it, and its tweets
+    # counted in their replies
+    parent = conn.execute(f'SELECT replyto FROM {db}.tweets WHERE tid = ?', (rows[0][0],)).fetchone()[0]
+    earlier = thread(conn, parent) if parent is not None else []
+    if not earlier:
+        return rows
+    ancestors = earlier[:[row[0] for row in earlier].index(parent) + 1]
+    depth, replies = ancestors[-1][4] + 1, rows[0][5] + 1
+    return ([row[:5] + (row[5] + replies,) for row in ancestors] +
+            [row[:4] + (row[4] + depth,) + row[5:] for row in rows])
+
+
+def archive_path(database, period):
+    return f'{os.path.splitext(os.path.basename(database))[0]}-{period}.db'
+
+
+def move_period(conn, db, period):
+    # Copies one period's planned tweets into the archive attached as db, then
+    # deletes them from the main database; runs inside the caller's transaction
+    plan = 'FROM temp.archive_tids a JOIN main.tweets t ON t.tid = a.tid WHERE a.period = ?'
+    conn.execute(f'''
+        INSERT OR REPLACE INTO {db}.tweets (tid, writer, tdate, text, replyto, root, depth, tdate_ms)
+        SELECT t.tid, t.writer, t.tdate, t.text, t.replyto, t.root, t.depth, t.tdate_ms {plan}
+    ''', (period,))
+    conn.execute(f'''
+        INSERT OR REPLACE INTO {db}.retweets (usr, tid, rdate, rdate_ms)
+        SELECT r.usr, r.tid, r.rdate, r.rdate_ms
+        FROM temp.archive_tids a JOIN main.retweets r ON r.tid = a.tid WHERE a.period = ?
+    ''', (period,))
+    conn.execute(f'''
+        INSERT OR REPLACE INTO {db}.mentions (tid, term)
+        SELECT m.tid, m.term
+        FROM temp.archive_tids a JOIN main.mentions m ON m.tid = a.tid WHERE a.period = ?
+    ''', (period,))
+    conn.execute(f'DELETE FROM {db}.tweets_fts WHERE rowid IN (SELECT tid FROM temp.archive_tids WHERE period = ?)',
+                 (period,))
+    conn.execute(f'''
+        INSERT INTO {db}.tweets_fts (rowid, text, terms)
+        SELECT t.tid, t.text,
+               COALESCE((SELECT group_concat(m.term, ' ') FROM main.mentions m WHERE m.tid = t.tid), '')
+        {plan}
+    ''', (period,))
+
+    # What the moved rows add to the counters, which the delete triggers are about to take off
+    conn.execute('DELETE FROM temp.moved_users')
+    conn.execute('DELETE FROM temp.moved_tweets')
+    conn.execute(f'INSERT INTO temp.moved_users (usr, tweets) SELECT t.writer, COUNT(*) {plan} GROUP BY t.writer',
+                 (period,))
+    conn.execute(f'''
+        INSERT INTO temp.moved_tweets (tid, retweets, replies)
+        SELECT tid, SUM(retweets), SUM(replies) FROM (
+            SELECT r.tid, COUNT(*) AS retweets, 0 AS replies
+            FROM temp.archive_tids a JOIN main.retweets r ON r.tid = a.tid WHERE a.period = ?
+            GROUP BY r.tid
+            UNION ALL
+            SELECT t.replyto, 0, COUNT(*) {plan} AND t.replyto IS NOT NULL
+            GROUP BY t.replyto
+        )
+        GROUP BY tid
+    ''', (period, period))
+
+    moved = 'SELECT tid FROM temp.archive_tids WHERE period = ?'
+    # Tweets first, so the mention triggers find no search index rows left to update
+    count = conn.execute(f'DELETE FROM main.tweets WHERE tid IN ({moved})', (period,)).rowcount
+    conn.execute(f'DELETE FROM main.mentions WHERE tid IN ({moved})', (period,))
+    conn.execute(f'DELETE FROM main.retweets WHERE tid IN ({moved})', (period,))
+    conn.execute(f'DELETE FROM main.timeline WHERE tid IN ({moved})', (period,))
+
+    conn.execute('''
+        INSERT INTO archived_user_stats (usr, tweets) SELECT usr, tweets FROM temp.moved_users WHERE 1
+        ON CONFLICT (usr) DO UPDATE SET tweets = tweets + excluded.tweets
+    ''')
+    conn.execute('''
+        INSERT INTO archived_tweet_stats (tid, retweets, replies)
+        SELECT tid, retweets, replies FROM temp.moved_tweets WHERE 1
+        ON CONFLICT (tid) DO UPDATE SET retweets = retweets + excluded.retweets, replies = replies + excluded.replies
+    ''')
+    conn.execute('''
+        UPDATE user_stats SET tweets = user_stats.tweets + m.tweets
+        FROM temp.moved_users m WHERE m.usr = user_stats.usr
+    ''')
+    conn.execute('''
+        UPDATE tweet_stats SET retweets = tweet_stats.retweets + m.retweets, replies = tweet_stats.replies + m.replies
+        FROM temp.moved_tweets m WHERE m.tid = tweet_stats.tid
+    ''')
+
+    conn.execute(f'''
+        INSERT INTO archives (period, path, first_date, last_date, first_ms, last_ms)
+        SELECT ?, ?, MIN(tdate), MAX(tdate), MIN(tdate_ms), MAX(tdate_ms) FROM {db}.tweets WHERE 1
+        ON CONFLICT (period) DO UPDATE SET first_date = excluded.first_date, last_date = excluded.last_date,
+                                           first_ms = excluded.first_ms, last_ms = excluded.last_ms
+    ''', (period, archive_path(main_file(conn), period)))
+    return count
+
+
+def move(conn, before, period='year'):
+    # Archives the conversations that ended before the cutoff, a time in
+    # milliseconds; returns {period: tweets moved}
+    fmt = PERIODS[period]
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS archive_tids (tid INTEGER PRIMARY KEY, period TEXT)')
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS moved_users (usr INT PRIMARY KEY, tweets INT)')
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS moved_tweets (tid INT PRIMARY KEY, retweets INT, replies INT)')
+    # A conversation is archived by the date of its first tweet, and only once
+    # nothing in it, tweet or retweet, is on or after the cutoff
+    candidates = '''
+        FROM tweets t JOIN tweets r ON r.tid = t.root
+        WHERE r.tdate_ms < ? AND t.root NOT IN (
+            SELECT root FROM tweets WHERE tdate_ms >= ? OR tdate_ms IS NULL
+            UNION
+            SELECT t2.root FROM retweets rt JOIN tweets t2 ON t2.tid = rt.tid WHERE rt.rdate_ms >= ?
+        )
+    '''
+    period_of = "strftime(?, r.tdate_ms / 1000, 'unixepoch')"
+    periods = [row[0] for row in conn.execute(f'SELECT DISTINCT {period_of} {candidates}',
+                                              (fmt, before, before, before))]
+    counts = {}
+    # ATTACH is not allowed inside a transaction, so each group of periods is
+    # attached first and then moved in one write transaction
+    for start in range(0, len(periods), MAX_ATTACHED):
+        group = periods[start:start + MAX_ATTACHED]
+        names = {}
+        for name in group:
+            names[name] = attach(conn, name, archive_path(main_file(conn), name))
+            prepare(conn, names[name])
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM temp.archive_tids')
+            conn.execute(f'''
+                INSERT INTO temp.archive_tids (tid, period)
+                SELECT t.tid, {period_of} {candidates}
+                AND {period_of} IN ({", ".join("?" * len(group))})
+            ''', [fmt, before, before, before, fmt] + group)
+            for name in group:
+                counts[name] = move_period(conn, names[name], name)
+            conn.execute('''
+                INSERT INTO meta (key, value) VALUES ('archive_cutoff', ?)
+                ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value)
+            ''', (before,))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            for name in names.values():
+                conn.execute(f'DETACH DATABASE {name}')
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move old tweets to archive databases")
+    commands = parser.add_subparsers(dest='command', required=True)
+    move_parser = commands.add_parser('move', help="archive conversations older than a date")
+    move_parser.add_argument('database')
+    move_parser.add_argument('--before', required=True, help="cutoff date, e.g. 2021-01-01")
+    move_parser.add_argument('--period', choices=sorted(PERIODS), default='year', help="one archive file per period")
+    move_parser.add_argument('--vacuum', action='store_true', help="shrink the main database afterwards")
+    commands.add_parser('list', help="show the archive files").add_argument('database')
+    args = parser.parse_args(argv)
+
+    conn = schema.connect(args.database)
+    try:
+        if args.command == 'move':
+            before = calendar.timegm(time.strptime(args.before, '%Y-%m-%d')) * 1000
+            counts = move(conn, before, args.period)
+            for period, count in counts.items():
+                print(f"{period}: {count} tweets archived to {archive_path(args.database, period)}")
+            if not counts:
+                print("Nothing to archive.")
+            if args.vacuum:
+                conn.execute('VACUUM')
+        else:
+            edge = cutoff(conn)
+            print(f"Cutoff: {queries.local_time(edge) if edge is not None else None}")
+            for period, path, first_ms, last_ms in archives(conn):
+                print(f"{period}: {path} ({queries.local_time(first_ms)} to {queries.local_time(last_ms)})")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
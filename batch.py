@@ -0,0 +1,209 @@
+"""
+Headless batch mode for the Twitter clone.
+
+   python batch.py <database> [commands.jsonl] [--batch-size 1000]
+
+Reads one JSON command per line from the file (or stdin) and writes one JSON
+result per line to stdout, using a single connection for the whole stream.
+Writes are grouped into transactions of --batch-size commands; each write runs
+under its own savepoint, so a failing command is reported and skipped
+without undoing the others. Reads see the batch's earlier writes.
+
+Commands ('id' is optional and echoed back):
+   {"op": "post", "user": 1, "text": "hello #world"}
+   {"op": "reply", "user": 1, "tid": 7, "text": "me too"}
+   {"op": "retweet", "user": 1, "tid": 7}
+   {"op": "follow", "user": 1, "target": 2}
+   {"op": "read_notifications", "user": 1, "upto": 42}
+   {"op": "feed", "user": 1, "after": [1704067200000, 7], "limit": 5}
+   {"op": "search", "keywords": "#world coffee", "after": null, "limit": 5}
+   {"op": "profile", "user": 2}
+   {"op": "stats", "tid": 7}
+   {"op": "thread", "tid": 7}
+   {"op": "trending", "hours": 24, "half_life": 6, "limit": 10}
+   {"op": "notifications", "user": 1, "after": null, "limit": 5}
+
+Results look like {"id": ..., "ok": true, "result": ...} or
+{"id": ..., "ok": false, "error": "..."}. Feed, search and notifications
+results carry a "next" key to pass as "after" for the following page. Dates are milliseconds
+since 1970-01-01 UTC.
+"""
+
+import argparse
+import json
+import sqlite3
+import sys
+
+import instrument
+import queries
+import schema
+
+CACHED_STATEMENTS = 512
+
+
+def limit(command, default=5):
+    # SQLite reads LIMIT -1 as no limit at all, so only positive sizes get through
+    value = int(command.get('limit', default))
+    if value < 1:
+        raise ValueError(f"limit must be at least 1, not {value}")
+    return value
+
+
+def page(rows, date_index, columns):
+    tweets = [dict(zip(columns, row)) for row in rows]
+    last = rows[-1] if rows else None
+    return {'tweets': tweets, 'next': [last[date_index], last[0]] if last else None}
+
+
+def post(conn, command):
+    return {'tid': queries.post_tweet(conn, command['user'], command['text'])}
+
+
+def reply(conn, command):
+    return {'tid': queries.post_tweet(conn, command['user'], command['text'], replyto=int(command['tid']))}
+
+
+def retweet(conn, command):
+    queries.retweet(conn, command['user'], command['tid'])
+
+
+def follow(conn, command):
+    queries.follow(conn, command['user'], command['target'])
+
+
+def read_notifications(conn, command):
+    queries.mark_notifications_read(conn, command['user'], command['upto'])
+
+
+def feed(conn, command):
+    rows = queries.feed_page(conn, command['user'], command.get('after'), limit=limit(command))
+    return page(rows, 2, ('tid', 'text', 'date'))
+
+
+def search(conn, command, reads=queries):
+    # reads can be the archive module, to page on into archived tweets
+    keywords = command['keywords']
+    if isinstance(keywords, str):
+        keywords = keywords.split()
+    if not keywords:
+        raise ValueError("no keywords given")
+    rows = reads.search_tweets_page(conn, keywords, command.get('after'), limit=limit(command))
+    return page(rows, 2, ('tid', 'writer', 'date', 'text'))
+
+
+def profile(conn, command, reads=queries):
+    # reads can be a cache.ReadCache in front of the queries module
+    details = reads.user_details(conn, command['user'])
+    if details is None:
+        raise LookupError(f"no user {command['user']}")
+    tweets, following, followers = reads.user_counts(conn, command['user'])
+    return {
+        'name': details[0], 'email': details[1], 'city': details[2], 'timezone': details[3],
+        'tweets': tweets, 'following': following, 'followers': followers,
+        'recent': [{'tid': tid, 'text': text, 'date': tdate}
+                   for tid, text, tdate in reads.recent_tweets(conn, command['user'])],
+    }
+
+
+def stats(conn, command, reads=queries):
+    retweets, replies = reads.tweet_counts(conn, command['tid'])
+    return {'retweets': retweets, 'replies': replies}
+
+
+def thread(conn, command, reads=queries):
+    rows = reads.thread(conn, command['tid'])
+    if not rows:
+        raise LookupError(f"no tweet {command['tid']}")
+    return [dict(zip(('tid', 'writer', 'date', 'text', 'depth', 'replies'), row)) for row in rows]
+
+
+def trending(conn, command):
+    trends = queries.trending(conn, limit(command, 10), command.get('hours', 24), command.get('half_life'))
+    return [{'term': term, 'score': score} for term, score in trends]
+
+
+def notifications(conn, command):
+    rows = queries.notifications_page(conn, command['user'], command.get('after'), limit(command))
+    return {
+        'notifications': [dict(zip(('nid', 'kind', 'actor', 'name', 'tid', 'text', 'date'), row)) for row in rows],
+        'next': rows[-1][0] if rows else None,
+        'unread': queries.unread_count(conn, command['user']),
+    }
+
+
+WRITES = {'post': post, 'reply': reply, 'retweet': retweet, 'follow': follow, 'read_notifications': read_notifications}
+READS = {'feed': feed, 'search': search, 'profile': profile, 'stats': stats, 'thread': thread, 'trending': trending,
+         'notifications': notifications}
+
+
+def run_command(conn, command):
+    op = command.get('op')
+    if op in WRITES:
+        conn.execute('SAVEPOINT command')
+        try:
+            result = WRITES[op](conn, command)
+        except BaseException:
+            conn.execute('ROLLBACK TO command')
+            raise
+        finally:
+            conn.execute('RELEASE command')
+        return result
+    if op in READS:
+        return READS[op](conn, command)
+    raise ValueError(f"unknown op {op!r}")
+
+
+def run(conn, lines, out, batch_size=1000):
+    # Returns (commands run, commands failed)
+    count = failed = pending = 0
+    try:
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            count += 1
+            command = {}
+            try:
+                command = json.loads(line)
+                if command.get('op') in WRITES and not conn.in_transaction:
+                    conn.execute('BEGIN')
+                response = {'ok': True, 'result': run_command(conn, command)}
+                pending += command.get('op') in WRITES
+            except (sqlite3.Error, ValueError, LookupError, KeyError, TypeError, AttributeError, OverflowError) as e:
+                failed += 1
+                response = {'ok': False, 'error': f"line {number}: {type(e).__name__}: {e}"}
+            if isinstance(command, dict) and 'id' in command:
+                response = {'id': command['id'], **response}
+            out.write(json.dumps(response) + '\n')
+            if pending >= batch_size:
+                conn.commit()
+                pending = 0
+    finally:
+        if conn.in_transaction:
+            conn.commit()
+        out.flush()
+    return count, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run Twitter clone commands from JSON lines")
+    parser.add_argument('database')
+    parser.add_argument('commands', nargs='?', help="defaults to stdin")
+    parser.add_argument('--batch-size', type=int, default=1000, help="writes per transaction")
+    args = parser.parse_args(argv)
+
+    db = schema.Database(args.database, CACHED_STATEMENTS, factory=instrument.connection_factory())
+    conn = db.connect()
+    instrument.add('startup.connect', db.connect_seconds)
+    source = open(args.commands, encoding='utf-8') if args.commands else sys.stdin
+    try:
+        count, failed = run(conn, source, sys.stdout, args.batch_size)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        conn.close()
+    print(f"{count} commands, {failed} failed", file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
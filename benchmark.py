@@ -0,0 +1,193 @@
+"""
+Per-query benchmark for the Twitter clone query paths.
+
+   python benchmark.py <database> [--samples 200] [--json results.json]
+                       [--baseline results.json --tolerance 1.5]
+
+Times the query behind each CLI screen against random users, tweets and
+keywords from the database, and reports p50/p99 latency, rows returned, SQLite
+VM steps (the closest measure of rows scanned that Python's sqlite3 exposes)
+and any full table scans in the query plans used. With --baseline the run
+exits with status 1 when a path's p99 is worse than the baseline by more than
+the tolerance factor, so it can gate a deploy.
+
+compose_tweet writes are rolled back after every sample and leave the
+database unchanged, so commit (fsync) time is not included.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+
+import queries
+import schema
+
+STEP_INTERVAL = 100  # VM instructions per progress callback
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def sample_inputs(conn, rng, samples):
+    # Random ids and keywords that actually occur in the database
+    max_usr = conn.execute('SELECT MAX(usr) FROM users').fetchone()[0] or 1
+    max_tid = conn.execute('SELECT MAX(tid) FROM tweets').fetchone()[0] or 1
+    terms = [row[0] for row in conn.execute('SELECT term FROM hashtags LIMIT 1000')] or ['none']
+    names = [row[0] for row in conn.execute('SELECT name FROM users LIMIT 1000') if row[0]] or ['none']
+    inputs = []
+    for _ in range(samples):
+        name = rng.choice(names)
+        start = rng.randrange(max(1, len(name) - 3))
+        inputs.append({
+            'usr': rng.randint(1, max_usr),
+            'tid': rng.randint(1, max_tid),
+            'keywords': [rng.choice(['#', '']) + rng.choice(terms)],
+            'name_part': name[start:start + 4],
+        })
+    return inputs
+
+
+def feed(conn, args):
+    rows = queries.feed_page(conn, args['usr'])
+    if rows:
+        rows += queries.feed_page(conn, args['usr'], after=(rows[-1][2], rows[-1][0]))
+    return rows
+
+
+def search(conn, args):
+    return queries.search_tweets_page(conn, args['keywords'])
+
+
+def search_users(conn, args):
+    return queries.search_users(conn, args['name_part'])
+
+
+def user_details(conn, args):
+    details = queries.user_details(conn, args['usr'])
+    queries.user_counts(conn, args['usr'])
+    return [details] + queries.recent_tweets(conn, args['usr'])
+
+
+def tweet_statistics(conn, args):
+    return [queries.tweet_counts(conn, args['tid'])]
+
+
+def compose_tweet(conn, args):
+    conn.execute('SAVEPOINT benchmark')
+    try:
+        return [queries.post_tweet(conn, args['usr'], 'benchmark tweet #' + args['keywords'][0].lstrip('#'))]
+    finally:
+        conn.execute('ROLLBACK TO benchmark')
+        conn.execute('RELEASE benchmark')
+
+
+# Query path name -> (the CLI function it stands for, runner)
+PATHS = {
+    'feed': ('display_tweets_for_user', feed),
+    'search': ('search_tweets', search),
+    'search_users': ('search_users', search_users),
+    'user_details': ('display_user_details', user_details),
+    'tweet_statistics': ('display_tweet_statistics', tweet_statistics),
+    'compose_tweet': ('compose_tweet', compose_tweet),
+}
+
+
+def table_scans(conn, statements):
+    # Base tables read with a full SCAN in any of the statements' query plans
+    scans = set()
+    for sql in statements:
+        if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+            continue
+        for row in conn.execute('EXPLAIN QUERY PLAN ' + sql):
+            detail = row[3].split()
+            # Schema-qualified names come from FTS5's own statements on its shadow tables
+            if detail[0] == 'SCAN' and '.' not in detail[1] and not detail[1].startswith('(') \
+                    and 'VIRTUAL' not in detail:
+                scans.add(detail[1])
+    return sorted(scans)
+
+
+def run_path(conn, runner, inputs):
+    steps = 0
+    statements = set()
+
+    def count_steps():
+        nonlocal steps
+        steps += STEP_INTERVAL
+        return 0
+
+    latencies, rows, vm_steps = [], [], []
+    conn.set_trace_callback(statements.add)
+    try:
+        for args in inputs:
+            steps = 0
+            conn.set_progress_handler(count_steps, STEP_INTERVAL)
+            started = time.perf_counter()
+            result = runner(conn, args)
+            latencies.append((time.perf_counter() - started) * 1000)
+            conn.set_progress_handler(None, 0)
+            rows.append(len(result))
+            vm_steps.append(steps)
+    finally:
+        conn.set_trace_callback(None)
+        conn.set_progress_handler(None, 0)
+    return {
+        'samples': len(inputs),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'rows': round(sum(rows) / len(rows), 1),
+        'vm_steps_p50': percentile(vm_steps, 0.50),
+        'scans': table_scans(conn, statements),
+    }
+
+
+def run(conn, samples=200, seed=1, paths=PATHS):
+    inputs = sample_inputs(conn, random.Random(seed), samples)
+    return {name: run_path(conn, PATHS[name][1], inputs) for name in paths}
+
+
+def regressions(results, baseline, tolerance):
+    return [name for name, result in results.items()
+            if name in baseline and result['p99_ms'] > baseline[name]['p99_ms'] * tolerance]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Twitter clone query paths")
+    parser.add_argument('database')
+    parser.add_argument('--samples', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--paths', nargs='+', choices=sorted(PATHS), default=list(PATHS))
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--baseline', help="results file from an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help="allowed p99 slowdown factor against the baseline")
+    args = parser.parse_args(argv)
+
+    conn = schema.connect(args.database)
+    try:
+        results = run(conn, args.samples, args.seed, args.paths)
+    finally:
+        conn.close()
+
+    print(f"{'path':<18}{'function':<26}{'p50 ms':>9}{'p99 ms':>9}{'rows':>7}{'vm steps':>10}  scans")
+    for name, result in results.items():
+        print(f"{name:<18}{PATHS[name][0]:<26}{result['p50_ms']:>9}{result['p99_ms']:>9}"
+              f"{result['rows']:>7}{result['vm_steps_p50']:>10}  {', '.join(result['scans']) or '-'}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(results, json.load(f), args.tolerance)
+        if slower:
+            print(f"p99 regression beyond {args.tolerance}x: {', '.join(slower)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
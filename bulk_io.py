@@ -0,0 +1,156 @@
+"""
+Streaming bulk import and export of the Twitter clone tables.
+
+   python bulk_io.py export <database> <directory> [--format csv|jsonl] [--tables ...]
+   python bulk_io.py import <database> <directory> [--format csv|jsonl] [--ignore-duplicates]
+
+Every table is one file in the directory named after it (users.csv,
+tweets.jsonl, ...). Rows are streamed through generators in both directions,
+so memory use does not depend on file size. An import inserts with executemany
+in batches, one transaction per table. Secondary indexes and triggers are
+dropped during the load and rebuilt once at the end, along with the search
+index, counters and timeline they maintain. Empty CSV fields are loaded as NULL.
+
+What was dropped is recorded in the database. If an import is killed before
+it puts everything back, the next import does so first, or run:
+
+   python schema.py restore-bulk-load <database>
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+
+import schema
+
+# Parents before children
+TABLES = ['users', 'hashtags', 'tweets', 'follows', 'retweets', 'mentions']
+BATCH_SIZE = 10000
+
+
+def columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            yield {key: (value if value != '' else None) for key, value in row.items()}
+
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_csv(path, names, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(names)
+        writer.writerows(rows)
+
+
+def write_jsonl(path, names, rows):
+    with open(path, 'w', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(dict(zip(names, row))) + '\n')
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl}
+
+
+def load_rows(conn, table, rows, ignore_duplicates=False, batch_size=BATCH_SIZE):
+    # rows is any iterable of dicts keyed by column name; missing keys load as NULL.
+    # Returns the number of rows read.
+    names = columns(conn, table)
+    verb = 'INSERT OR IGNORE' if ignore_duplicates else 'INSERT'
+    sql = f'{verb} INTO {table} ({", ".join(names)}) VALUES ({", ".join("?" * len(names))})'
+    values = (tuple(row.get(name) for name in names) for row in rows)
+    count = 0
+    with conn:
+        while True:
+            batch = list(itertools.islice(values, batch_size))
+            if not batch:
+                return count
+            conn.executemany(sql, batch)
+            count += len(batch)
+
+
+def bulk_load(conn, sources, ignore_duplicates=False):
+    # sources maps table names to row iterables. Indexes and triggers are
+    # restored and derived tables rebuilt even if a load fails part way.
+    conn.execute('BEGIN IMMEDIATE')
+    schema.drop_indexes_and_triggers(conn, TABLES)
+    conn.commit()
+    counts = {}
+    try:
+        for table in TABLES:
+            if table in sources:
+                counts[table] = load_rows(conn, table, sources[table], ignore_duplicates)
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.execute('BEGIN IMMEDIATE')
+        schema.restore_indexes_and_triggers(conn)
+        conn.commit()
+    return counts
+
+
+def import_directory(conn, directory, fmt='csv', ignore_duplicates=False):
+    sources = {}
+    for table in TABLES:
+        path = os.path.join(directory, f'{table}.{fmt}')
+        if os.path.exists(path):
+            sources[table] = READERS[fmt](path)
+    return bulk_load(conn, sources, ignore_duplicates)
+
+
+def export_table(conn, table, path, fmt='csv'):
+    names = columns(conn, table)
+    count = 0
+
+    def rows():
+        nonlocal count
+        for row in conn.execute(f'SELECT {", ".join(names)} FROM {table}'):
+            count += 1
+            yield row
+
+    WRITERS[fmt](path, names, rows())
+    return count
+
+
+def export_directory(conn, directory, fmt='csv', tables=TABLES):
+    os.makedirs(directory, exist_ok=True)
+    return {table: export_table(conn, table, os.path.join(directory, f'{table}.{fmt}'), fmt) for table in tables}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import and export of Twitter clone tables")
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('database')
+    parser.add_argument('directory')
+    parser.add_argument('--format', choices=sorted(READERS), default='csv')
+    parser.add_argument('--tables', nargs='+', choices=TABLES, default=TABLES, help="tables to export")
+    parser.add_argument('--ignore-duplicates', action='store_true',
+                        help="skip rows whose key already exists instead of failing")
+    args = parser.parse_args(argv)
+
+    conn = schema.connect(args.database)
+    try:
+        if args.command == 'import':
+            counts = import_directory(conn, args.directory, args.format, args.ignore_duplicates)
+        else:
+            counts = export_directory(conn, args.directory, args.format, args.tables)
+        for table, count in counts.items():
+            print(f"{table}: {count} rows")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Read cache for profiles, recent tweets and tweet statistics.
+
+A ReadCache sits in front of queries.user_details, user_counts, recent_tweets
+and tweet_counts, with the same signatures, so it can be passed wherever those
+are called. Entries are kept least-recently-used first, up to max_entries, and
+expire after ttl seconds.
+
+The write paths invalidate exactly the entries a write changes, once it has
+committed:
+
+    cache.on_tweet(writer, replyto)   # compose_tweet, compose_reply
+    cache.on_retweet(usr, tid)
+    cache.on_follow(flwer, flwee)
+
+Writes by other processes are noticed through PRAGMA data_version on the watch
+connection, which changes whenever another connection commits; the whole cache
+is then dropped. Where this process's own writes go through a different
+connection than the watch connection (the server's write queue), call ack()
+after invalidating so they do not drop the cache as well. An outside write
+committed in the same moment can then be missed until its entries expire.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import queries
+
+
+class ReadCache:
+    def __init__(self, watch, max_entries=4096, ttl=60.0):
+        self.watch = watch
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+        self._entries = OrderedDict()  # key -> (expires, value)
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a load that raced a write is not stored
+        self._generation = 0
+        self._data_version = self._read_data_version()
+
+    def _read_data_version(self):
+        return self.watch.execute('PRAGMA data_version').fetchone()[0]
+
+    def _check_data_version(self):
+        version = self._read_data_version()
+        if version != self._data_version:
+            self._data_version = version
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._generation += 1
+
+    def get(self, key, load):
+        now = time.monotonic()
+        with self._lock:
+            self._check_data_version()
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+        value = load()
+        # Missing rows are not cached, a user or tweet may be created next
+        if value is None:
+            return value
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (now + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def ack(self):
+        # Take the current data version as seen, after invalidating for a write
+        # made through another connection of this process
+        with self._lock:
+            self._data_version = self._read_data_version()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'invalidations': self.invalidations}
+
+    # Cached reads, called like the queries functions they wrap
+
+    def user_details(self, conn, usr):
+        return self.get(('details', usr), lambda: queries.user_details(conn, usr))
+
+    def user_counts(self, conn, usr):
+        return self.get(('counts', usr), lambda: queries.user_counts(conn, usr))
+
+    def recent_tweets(self, conn, usr, limit=3):
+        # Only the profile's usual page is cached
+        if limit != 3:
+            return queries.recent_tweets(conn, usr, limit)
+        return self.get(('recent', usr), lambda: queries.recent_tweets(conn, usr))
+
+    def tweet_counts(self, conn, tid):
+        return self.get(('stats', tid), lambda: queries.tweet_counts(conn, tid))
+
+    # Invalidation for the write paths, after commit
+
+    def on_tweet(self, writer, replyto=None):
+        keys = [('counts', writer), ('recent', writer)]
+        if replyto is not None:
+            keys.append(('stats', replyto))
+        self.invalidate(*keys)
+
+    def on_retweet(self, usr, tid):
+        self.invalidate(('stats', tid))
+
+    def on_follow(self, flwer, flwee):
+        self.invalidate(('counts', flwer), ('counts', flwee))
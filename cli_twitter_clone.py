@@ -1,595 +1,650 @@
-"""
-Running Instructions for the Twitter Clone Program:
-1. Connect to the database and run main()
-2. At the prompt, choose one of the following options:
-   - Enter '1' to log in with an existing user account.
-   - Enter '2' to register a new user account.
-   - Enter '3' to exit the program.
-3. Once logged in, you will be presented with the user interface. Choose an option by entering the corresponding letter:
-   - 'd' to display tweets.
-   - 's' to search for tweets.
-   - 'u' to search for users.
-   - 'c' to compose a tweet.
-   - 'l' to list followers.
-   - 'q' to log out and return to the main menu.
-4. To exit the program from the main menu, enter '3' again.
-
-We assume that there are no private accounts. All accounts are public.
-However, tweet feed would only show followings tweets.
-Other public tweets can be accessed through search
-"""
-
-import sqlite3
-import sys
-import datetime
-import maskpass
-
-current_user_id = None
-
-# Connect to the SQLite database
-database = None
-conn = sqlite3.connect(database)
-cursor = conn.cursor()
-
-def login():
-    usr = input("Enter user id: ")
-    pwd = maskpass.askpass("Enter password: ")
-    
-    # Check if the email and pwd match an entry in the users table
-    cursor.execute('SELECT usr FROM users WHERE usr = ? AND pwd = ?', (usr, pwd))
-    account = cursor.fetchone()
-    
-    if account:
-        # User is logged in, display tweets
-        print("\nLogin successful!\n")
-        global current_user_id
-        current_user_id = account[0] 
-        user_interface(current_user_id)
-    else:
-        print("Invalid login credentials. Please try again or register if you are a new user.")
-    return
-
-def register():
-    try:
-        print("\nRegistration")
-        name = input("Enter your name: ")
-        email = input("Enter your email: ")
-        city = input("Enter your city: ")
-        timezone = input("Enter your timezone: ")
-        pwd = input("Create a password: ")
-        
-        # Generate a unique user ID
-        cursor.execute('SELECT MAX(usr) FROM users')
-        max_usr = cursor.fetchone()[0]
-        usr = max_usr + 1 if max_usr is not None else 1
-        
-        # Insert the new user into the users table
-        cursor.execute('INSERT INTO users (usr, pwd, name, email, city, timezone) VALUES (?, ?, ?, ?, ?, ?)',
-                       (usr, pwd, name, email, city, timezone))
-        conn.commit()
-        
-        print(f"Registration successful. Your user ID is: {usr}")
-    except sqlite3.Error as e:
-        print(f"An error occurred: {e.args[0]}")
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-    return
-
-def search_tweets(usr):
-    try:
-        keywords = input("Enter keyword(s) separated by space: ").split()
-        keyword_conditions = " OR ".join([
-            f"t.text LIKE '%{keyword}%'" for keyword in keywords
-        ])
-
-        offset = 0
-        while True:
-            query = f'''
-            SELECT DISTINCT t.tid, t.writer, t.tdate, t.text
-            FROM tweets t
-            LEFT JOIN mentions m ON t.tid = m.tid
-            WHERE {keyword_conditions}
-            ORDER BY t.tdate DESC
-            LIMIT 5 OFFSET {offset}
-            '''
-            
-            cursor.execute(query)
-            tweets = cursor.fetchall()
-
-            if not tweets:
-                print("No more tweets found.")
-                return
-
-            # Display tweets
-            for idx, tweet in enumerate(tweets, start=1):
-                print(f"{idx}. {tweet[3]} (Date: {tweet[2]})")
-            
-            # Handle tweet selection
-            tweet_selection = input("Select a tweet number for more options, 'n' for next page, or 'b' to go back: ")
-            if tweet_selection.lower() == 'n':
-                offset += 5
-                continue
-            elif tweet_selection.lower() == 'b' and offset >= 5:
-                offset -= 5
-                continue
-            elif tweet_selection.lower() == "b" and offset < 5:
-                return
-            elif tweet_selection.isdigit() and 1 <= int(tweet_selection) <= len(tweets):
-                selected_tweet = tweets[int(tweet_selection) - 1]
-                tweet_id = selected_tweet[0]
-                print(f"Selected tweet: {selected_tweet[3]}")
-                # Show tweet statistics, reply, or retweet options
-                action = input("Choose 'stats' for statistics, 'reply' to reply, or 'retweet' to retweet: ")
-                if action.lower() == 'stats':
-                    display_tweet_statistics(tweet_id)
-                elif action.lower() == 'reply':
-                    compose_reply(tweet_id, usr)
-                elif action.lower() == 'retweet':
-                    retweet(tweet_id, usr)
-            else:
-                print("Invalid selection. Please try again.")
-                
-    except sqlite3.Error as e:
-        print(f"An error occurred: {e.args[0]}")
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-    return
-
-def search_users(user_id=None):
-    keyword = input("Enter a keyword to search for users: ").strip()
-    sanitized_keyword = f"%{keyword}%".lower()  # Sanitize the keyword
-
-    try:
-        base_query = '''
-            SELECT usr, name, city FROM users
-            WHERE LOWER(name) LIKE ?
-        '''
-        
-        cursor.execute(base_query, (sanitized_keyword,))
-        name_matches = cursor.fetchall()
-
-        base_query = '''
-            SELECT usr, name, city FROM users
-            WHERE LOWER(name) NOT LIKE ?
-            AND LOWER(city) LIKE ?
-        '''
-        cursor.execute(base_query, (sanitized_keyword, sanitized_keyword))
-        city_matches = cursor.fetchall()
-
-        # sort results matched by name and city seperately and combine them
-        name_matches.sort(key=lambda x: len(x[1]))
-        city_matches.sort(key=lambda x: len(x[2]))
-        users = name_matches + city_matches
-
-        if not users:
-            print("No users found.")
-            return
-        
-        # Pagination and display logic
-        page = 0
-        while True:
-            start_index = page * 5
-            end_index = start_index + 5
-            current_page_users = users[start_index:end_index]
-            
-            if not current_page_users:
-                print("No more users to display.")
-                return
-
-            for user in current_page_users:
-                print(f"UserID: {user[0]}, Name: {user[1]}, City: {user[2]}")
-
-            selected_user = input("Enter a UserID to see more information, 'next' for more users, or 'back' to return: ").strip()
-            if selected_user.isdigit():
-                display_user_details(int(selected_user))
-            elif selected_user == 'next':
-                page += 1
-            elif selected_user == 'back':
-                return
-            else:
-                print("Invalid input, please try again.")
-
-    except sqlite3.Error as e:
-        print(f"An error occurred: {e}")
-    return
-
-def display_user_details(user_id):
-    try:
-        # Fetch user details
-        cursor.execute('''
-            SELECT name, email, city, timezone FROM users WHERE usr = ?
-        ''', (user_id,))
-        user_details = cursor.fetchone()
-
-        # Fetch user's tweet count, followers, and following counts
-        cursor.execute('''
-            SELECT
-            (SELECT COUNT(*) FROM tweets WHERE writer = ?) as tweet_count,
-            (SELECT COUNT(*) FROM follows WHERE flwee = ?) as following_count,
-            (SELECT COUNT(*) FROM follows WHERE flwer = ?) as follower_count
-        ''', (user_id, user_id, user_id))
-        counts = cursor.fetchone()
-
-        # Fetch up to 3 most recent tweets
-        cursor.execute('''
-            SELECT tid, text FROM tweets WHERE writer = ? ORDER BY tdate DESC LIMIT 3
-        ''', (user_id,))
-        recent_tweets = cursor.fetchall()
-
-        # Displaying the details
-        print(f"User ID: {user_id} Details:")
-        print(f"Name: {user_details[0]}")
-        print(f"Email: {user_details[1]}")
-        print(f"City: {user_details[2]}")
-        print(f"Timezone: {user_details[3]}")
-        print(f"Number of Tweets: {counts[0]}")
-        print(f"Number of Following: {counts[1]}")
-        print(f"Number of Followers: {counts[2]}")
-        print("Most Recent Tweets:")
-        for tweet in recent_tweets:
-            print(f"Tweet ID: {tweet[0]}, Tweet: {tweet[1]}")
-
-        # Actions
-        while True:  # Loop to allow user to go back
-            action = input("Choose 'follow' to follow this user, 'reply' to reply to a tweet, 'retweet' to retweet, 'tweets' to see more tweets, or 'back' to go back: ").strip().lower()
-            if action == 'follow':
-                follow_user(user_id)
-            elif action == 'reply':
-                tweet_id = input("Enter the Tweet ID you want to reply to: ").strip()
-                if tweet_id.isdigit():
-                    compose_reply(int(tweet_id), current_user_id)
-            elif action == 'retweet':
-                tweet_id = input("Enter the Tweet ID you want to retweet: ").strip()
-                if tweet_id.isdigit():
-                    retweet(int(tweet_id), current_user_id)
-            elif action == 'tweets':
-                display_more_tweets(user_id)
-            elif action == 'back':
-                user_interface(current_user_id)  # Call the user interface function to go back
-                return  # Exit the loop to prevent further input after going back
-            else:
-                print("Invalid option.")
-
-    except sqlite3.Error as e:
-        print(f"An error occurred: {e}")
-    return
-
-def follow_user(target_user_id):
-    try:
-        cursor.execute('''
-            INSERT INTO follows (flwer, flwee, start_date) VALUES (?, ?, DATE('now'))
-        ''', (current_user_id, target_user_id))
-        conn.commit()
-        print("You are now following the user.")
-    except sqlite3.Error as e:
-        print(f"An error occurred: {e}")
-        conn.rollback()
-    return
-
-def display_more_tweets(user_id):
-    try:
-        # Assuming the user wants to see more than the 3 most recent tweets
-        cursor.execute('''
-            SELECT tid, text FROM tweets WHERE writer = ? ORDER BY tdate DESC
-        ''', (user_id,))
-        tweets = cursor.fetchall()
-
-        # Pagination logic for tweets
-        page = 0
-        while True:
-            start_index = page * 5
-            end_index = start_index + 5
-            for tweet in tweets[start_index:end_index]:
-                print(f"Tweet ID: {tweet[0]}, Tweet: {tweet[1]}")
-
-            if end_index >= len(tweets):
-                print("End of tweets.")
-                return
-            else:
-                cont = input("Show more tweets? (y/n): ").strip().lower()
-                if cont == 'y':
-                    page += 1
-                else:
-                    return
-    except sqlite3.Error as e:
-        print(f"An error occurred: {e}")
-    return
-
-def compose_tweet(usr):
-    try:
-        tweet_text = input("Compose your tweet (hashtags with #): ")
-        hashtags = [word[1:] for word in tweet_text.split() if word.startswith("#")]
-        current_time = datetime.datetime.now().strftime('%Y-%m-%d')
-
-        # Get the next tweet ID
-        cursor.execute('SELECT MAX(tid) FROM tweets')
-        max_id = cursor.fetchone()[0]  # Fetchone returns a tuple, [0] gets the value
-        tid = max_id + 1 if max_id else 1  # If the table is empty, start with 1
-
-        # Insert tweet into tweets table
-        tweet_insert_query = 'INSERT INTO tweets (tid, writer, tdate, text) VALUES (?, ?, ?, ?)'
-        cursor.execute(tweet_insert_query, (tid, usr, current_time, tweet_text))
-
-        # Insert hashtags into hashtags table and mentions table
-        for hashtag in hashtags:
-            # Ensure the hashtag is in the hashtags table
-            cursor.execute('INSERT OR IGNORE INTO hashtags (term) VALUES (?)', (hashtag,))
-            conn.commit()  # It's safe to commit here since hashtags table is independent
-
-            # Insert into mentions table
-            cursor.execute('INSERT INTO mentions (tid, term) VALUES (?, ?)', (tid, hashtag))
-        
-        # Final commit for tweet and mentions
-        conn.commit()  
-
-        print("Tweet posted successfully!")
-        
-    except sqlite3.Error as e:
-        print(f"An error occurred: {e.args[0]}")
-        conn.rollback()
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        conn.rollback()
-    finally:
-        user_interface(usr)  # Return to the main user interface function
-    return
-
-def list_followers(usr):
-    try:
-        query = '''
-        SELECT usr, name FROM users
-        WHERE usr IN (SELECT flwer FROM follows WHERE flwee = ?)
-        '''
-        cursor.execute(query, (usr,))
-        followers = cursor.fetchall()
-
-        # Display followers
-        print("Your followers:")
-        for idx, follower in enumerate(followers):
-            print(f"{idx + 1}. {follower[1]} (User ID: {follower[0]})")
-
-        # Handle follower selection
-        selection = input("Select a follower to view more info, or type 'back' to return: ")
-        if selection.lower() == 'back':
-            return
-        selected_idx = int(selection) - 1
-        selected_usr = followers[selected_idx][0]
-
-        # Fetch additional information about the follower
-        num_tweets_query = 'SELECT COUNT(*) FROM tweets WHERE writer = ?'
-        num_following_query = 'SELECT COUNT(*) FROM follows WHERE flwer = ?'
-        num_followers_query = 'SELECT COUNT(*) FROM follows WHERE flwee = ?'
-        recent_tweets_query = 'SELECT tid, text, tdate FROM tweets WHERE writer = ? ORDER BY tdate DESC LIMIT 3'
-
-        cursor.execute(num_tweets_query, (selected_usr,))
-        num_tweets = cursor.fetchone()[0]
-
-        cursor.execute(num_following_query, (selected_usr,))
-        num_following = cursor.fetchone()[0]
-
-        cursor.execute(num_followers_query, (selected_usr,))
-        num_followers = cursor.fetchone()[0]
-
-        cursor.execute(recent_tweets_query, (selected_usr,))
-        recent_tweets = cursor.fetchall()
-
-        # Display the follower information
-        print(f"User ID: {selected_usr}")
-        print(f"Number of tweets: {num_tweets}")
-        print(f"Following: {num_following}")
-        print(f"Followers: {num_followers}")
-        print("Most recent tweets:")
-        for tweet in recent_tweets:
-            print(f"Tweet ID: {tweet[0]}, Date: {tweet[2]}, Tweet: {tweet[1]}")
-
-        # Handle tweet interaction
-        action = input("Select a tweet to reply (R) / retweet (RT) or type 'follow' to follow this user: ")
-        if action.lower() == "r":
-            tweet_id = input("Enter the Tweet ID to reply to: ")
-            if tweet_id.isdigit():
-                compose_reply(int(tweet_id), usr)
-            else:
-                print("Invalid Tweet ID. Please enter a numeric value.")
-        elif action.lower() == "rt":
-            tweet_id = input("Enter the Tweet ID to retweet: ")
-            if tweet_id.isdigit():
-                retweet(int(tweet_id), usr)
-            else:
-                print("Invalid Tweet ID. Please enter a numeric value.")
-        elif action.lower() == "follow":
-            follow_user(selected_usr)
-        else:
-            print("Invalid action. Please enter 'R' to reply, 'RT' to retweet, or 'follow' to follow the user.")
-
-    except sqlite3.Error as e:
-        print(f"An error occurred: {e.args[0]}")
-        conn.rollback()
-    except ValueError as e:
-        print(f"A value error occurred: {e}")
-    except IndexError as e:
-        print(f"An index error occurred: {e}")
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-    finally:
-        user_interface(usr)  # Assuming this is the function to return to the user interface
-    return
-
-def logout():
-    print("You have been logged out.")
-    return
-
-def display_tweets_for_user(user_id, page=0):
-    try:
-        offset = page * 5
-        # Retrieve 5 tweets starting from the offset
-        cursor.execute('''
-            SELECT t.tid, t.text, t.tdate
-			FROM tweets t
-			JOIN follows f ON t.writer = f.flwee
-			WHERE f.flwer = :user
-			UNION
-			SELECT r.tid, t.text, r.rdate
-			FROM retweets r
-			JOIN tweets t ON r.tid = t.tid
-			JOIN follows f ON t.writer = f.flwee
-			WHERE f.flwer = :user
-			ORDER BY tdate DESC
-            LIMIT 5 OFFSET ?
-        ''', (user_id, offset))
-
-        tweets = cursor.fetchall()
-        if not tweets:
-            if page == 0:
-                print("You have no tweets to display.")
-            else:
-                print("No more tweets to display.")
-            # Add an input here to allow the user to go back to the main menu
-            input("Press any key to return to the main menu...")
-            return  # This will exit the function and continue with the main loop
-
-        for idx, tweet in enumerate(tweets, start=1):
-            print(f"{idx}. {tweet[1]} (Date: {tweet[2]})")
-
-        tweet_selection = input("Select a tweet number to view statistics, 'n' to see more tweets, or 'b' to go back: ")
-        if tweet_selection.lower() == 'n':
-            # Display next page of tweets
-            display_tweets_for_user(user_id, page+1)
-        elif tweet_selection.lower() == 'b':
-            # User chooses to go back to the main menu
-            return
-        elif tweet_selection.isdigit() and 0 < int(tweet_selection) <= len(tweets):
-            # Selected a tweet, now get tweet statistics and interact
-            selected_tweet_id = tweets[int(tweet_selection) - 1][0]
-            display_tweet_statistics(selected_tweet_id)
-            interact_with_tweet(selected_tweet_id, user_id)
-        else:
-            print("Invalid selection. Please try again.")
-            return
-
-    except sqlite3.Error as e:
-        print(f"An error occurred: {e}")
-    return
-
-def display_tweet_statistics(tweet_id):
-    try:
-        # Retrieve tweet statistics
-        cursor.execute('''
-            SELECT COUNT(DISTINCT r.tid), COUNT(DISTINCT tw.tid)
-            FROM tweets t
-            LEFT JOIN retweets r ON t.tid = r.tid
-            LEFT JOIN tweets tw ON t.tid = tw.replyto
-            WHERE t.tid = ?
-        ''', (tweet_id,))
-        
-        stats = cursor.fetchone()
-        print(f"Retweets: {stats[0]}, Replies: {stats[1]}")
-    except sqlite3.Error as e:
-        print(f"An error occurred: {e}")
-    return
-
-def interact_with_tweet(tweet_id, user_id):
-    print("1. Reply to Tweet")
-    print("2. Retweet")
-    action = input("Choose an action (1-2) or press any other key to go back: ")
-    if action == '1':
-        compose_reply(tweet_id, user_id)
-    elif action == '2':
-        retweet(tweet_id, user_id)
-    return
-
-def compose_reply(tweet_id, user_id):
-    reply_text = input("Type your reply (or type 'back' to return to the main menu): ")
-    if reply_text.lower() == 'back':
-        return
-    try:
-        # Get the next tweet ID for the reply
-        cursor.execute('SELECT MAX(tid) FROM tweets')
-        max_id = cursor.fetchone()[0]  # Fetchone returns a tuple, [0] gets the value
-        reply_tid = max_id + 1 if max_id else 1  # If the table is empty, start with 1
-
-        # Insert the reply into the tweets table, with reply_to field set to the original tweet's ID
-        cursor.execute('''
-            INSERT INTO tweets (tid, writer, tdate, text, replyto)
-            VALUES (?, ?, datetime('now'), ?, ?)
-        ''', (reply_tid, user_id, reply_text, tweet_id))
-        conn.commit()
-        print("Your reply was posted successfully.")
-
-    except sqlite3.Error as e:
-        print(f"An error occurred: {e}")
-        conn.rollback()
-    finally:
-        user_interface(user_id)  # Call the main menu function to return
-    return
-
-def retweet(tweet_id, user_id):
-    # Confirm retweet action
-    confirm = input("Press 'y' to retweet or 'back' to return to the main menu: ")
-    if confirm.lower() == 'back':
-        return
-    elif confirm.lower() == 'y':
-        try:
-            # Insert the retweet into the retweets table
-            cursor.execute('''
-                INSERT INTO retweets (usr, tid, rdate)
-                VALUES (?, ?, date('now'))
-            ''', (user_id, tweet_id))
-            conn.commit()
-            print("The tweet was retweeted successfully.")
-        except sqlite3.Error as e:
-            print(f"An error occurred: {e}")
-            conn.rollback()
-        finally:
-            user_interface(user_id)
-    return
-
-def user_interface(user_id):
-    while True:
-        print("\n--- Welcome to the Twitter Clone! ---")        
-        print("\nOptions:")
-        print("d - Display tweets")
-        print("s - Search for tweets")
-        print("u - Search for users")
-        print("c - Compose a tweet")
-        print("l - List followers")
-        print("q - Logout")
-        
-        choice = input("Choose an option: ").lower()
-        
-        if choice == "s":
-            search_tweets(user_id)
-        elif choice == "u":
-            search_users(user_id)
-        elif choice == "d":
-            display_tweets_for_user(user_id)
-        elif choice == "c":
-            compose_tweet(user_id)
-        elif choice == "l":
-            list_followers(user_id)
-        elif choice == "q":
-            logout()
-            return
-        else:
-            print("Invalid option, please try again.")
-    return
-
-# Main loop
-def main():
-    while True:
-        print("\n1. Login\n2. Register\n3. Exit")
-        user_choice = input("Choose an option: ")
-        
-        if user_choice == "1":
-            user_id = login()
-            if user_id:
-                user_interface(user_id)
-        elif user_choice == "2":
-            register()
-        elif user_choice == "3":
-            print("Exiting the program...")
-            exit()
-        else:
-            print("Invalid input, please try again.")
-
-if __name__ == "__main__":
-    main()
+"""
+Running Instructions for the Twitter Clone Program:
+1. Run main(), e.g. python cli_twitter_clone.py <database>; the database can also
+   be named by the TWITCLONE_DB environment variable. It is opened on the first
+   login or registration.
+2. At the prompt, choose one of the following options:
+   - Enter '1' to log in with an existing user account.
+   - Enter '2' to register a new user account.
+   - Enter '3' to exit the program.
+3. Once logged in, you will be presented with the user interface. Choose an option by entering the corresponding letter:
+   - 'd' to display tweets.
+   - 's' to search for tweets.
+   - 'u' to search for users.
+   - 'c' to compose a tweet.
+   - 'l' to list followers.
+   - 't' to see trending hashtags.
+   - 'r' to get suggestions of who to follow.
+   - 'n' to see who replied to, retweeted or followed you.
+   - 'q' to log out and return to the main menu.
+4. To exit the program from the main menu, enter '3' again.
+
+We assume that there are no private accounts. All accounts are public.
+However, tweet feed would only show followings tweets.
+Other public tweets can be accessed through search
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+import archive
+import cache
+import instrument
+import queries
+import schema
+
+current_user_id = None
+
+# The SQLite database, opened by open_database() when it is first needed
+database = os.environ.get('TWITCLONE_DB')
+db = schema.Database(database, factory=instrument.connection_factory())
+conn = None
+
+# Profiles, recent tweets and tweet statistics, invalidated by the write paths below
+read_cache = None
+
+# Follow graph for suggestions, loaded the first time they are asked for
+follow_graph = None
+
+def show_time(ms):
+    # Stored times are UTC milliseconds; show them in the logged-in user's timezone
+    details = read_cache.user_details(conn, current_user_id)
+    return queries.local_time(ms, details[3] if details else None)
+
+def open_database():
+    global conn, read_cache
+    if conn is None:
+        conn = db.conn
+        instrument.add('startup.connect', db.connect_seconds)
+        read_cache = cache.ReadCache(conn)
+    return conn
+
+def login():
+    # Only needed for interactive logins, so not imported with the module
+    import maskpass
+    open_database()
+    usr = input("Enter user id: ")
+    pwd = maskpass.askpass("Enter password: ")
+    
+    # Check if the email and pwd match an entry in the users table
+    account = conn.execute('SELECT usr FROM users WHERE usr = ? AND pwd = ?', (usr, pwd)).fetchone()
+    
+    if account:
+        # User is logged in, display tweets
+        print("\nLogin successful!\n")
+        global current_user_id
+        current_user_id = account[0] 
+        unread = queries.unread_count(conn, current_user_id)
+        if unread:
+            print(f"You have {unread} new notification(s). Choose 'n' to see them.")
+        # main() opens the user interface for the returned user
+        return current_user_id
+    else:
+        print("Invalid login credentials. Please try again or register if you are a new user.")
+    return
+
+def register():
+    try:
+        open_database()
+        print("\nRegistration")
+        name = input("Enter your name: ")
+        email = input("Enter your email: ")
+        city = input("Enter your city: ")
+        timezone = input("Enter your timezone: ")
+        pwd = input("Create a password: ")
+        
+        # Insert the new user; SQLite allocates the user ID inside the INSERT
+        usr = conn.execute('''
+            INSERT INTO users (pwd, name, email, city, timezone) VALUES (?, ?, ?, ?, ?)
+            RETURNING usr
+        ''', (pwd, name, email, city, timezone)).fetchone()[0]
+        conn.commit()
+        
+        print(f"Registration successful. Your user ID is: {usr}")
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e.args[0]}")
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+    return
+
+def search_tweets(usr, keywords=None):
+    try:
+        if keywords is None:
+            keywords = input("Enter keyword(s) separated by space: ").split()
+        if not keywords:
+            print("Please enter at least one keyword.")
+            return
+
+        # Keyset pagination: only the key of the page being moved away from is carried
+        page = 0
+        after = before = None
+        while True:
+            tweets = archive.search_tweets_page(conn, keywords, after, before)
+
+            if not tweets:
+                print("No more tweets found.")
+                return
+
+            # Display tweets
+            for idx, tweet in enumerate(tweets, start=1):
+                print(f"{idx}. {tweet[3]} (Date: {show_time(tweet[2])})")
+            
+            # Handle tweet selection
+            tweet_selection = input("Select a tweet number for more options, 'n' for next page, or 'b' to go back: ")
+            if tweet_selection.lower() == 'n':
+                after, before = (tweets[-1][2], tweets[-1][0]), None
+                page += 1
+                continue
+            elif tweet_selection.lower() == 'b' and page > 0:
+                after, before = None, (tweets[0][2], tweets[0][0])
+                page -= 1
+                continue
+            elif tweet_selection.lower() == "b" and page == 0:
+                return
+            elif tweet_selection.isdigit() and 1 <= int(tweet_selection) <= len(tweets):
+                selected_tweet = tweets[int(tweet_selection) - 1]
+                tweet_id = selected_tweet[0]
+                print(f"Selected tweet: {selected_tweet[3]}")
+                # Show tweet statistics, reply, or retweet options
+                action = input("Choose 'stats' for statistics, 'thread' for the conversation, 'reply' to reply, or 'retweet' to retweet: ")
+                if action.lower() == 'stats':
+                    display_tweet_statistics(tweet_id)
+                elif action.lower() == 'thread':
+                    display_thread(tweet_id, usr)
+                elif action.lower() == 'reply':
+                    compose_reply(tweet_id, usr)
+                elif action.lower() == 'retweet':
+                    retweet(tweet_id, usr)
+            else:
+                print("Invalid selection. Please try again.")
+                
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e.args[0]}")
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+    return
+
+def search_users(user_id=None):
+    keyword = input("Enter a keyword to search for users: ").strip()
+
+    try:
+        # Pages are read on demand, keyed on the ranking of the last user shown
+        user_pages = queries.pages(lambda after, limit: queries.search_users(conn, keyword, after, limit),
+                                   queries.user_search_key)
+        current_page_users, more = next(user_pages, (None, False))
+        if not current_page_users:
+            print("No users found.")
+            return
+
+        while True:
+            for user in current_page_users:
+                print(f"UserID: {user[0]}, Name: {user[1]}, City: {user[2]}")
+
+            selected_user = input("Enter a UserID to see more information, 'next' for more users, or 'back' to return: ").strip()
+            if selected_user.isdigit():
+                display_user_details(int(selected_user))
+            elif selected_user == 'next':
+                if not more:
+                    print("No more users to display.")
+                    return
+                current_page_users, more = next(user_pages)
+            elif selected_user == 'back':
+                return
+            else:
+                print("Invalid input, please try again.")
+
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+    return
+
+def display_user_details(user_id):
+    try:
+        # Fetch user details
+        user_details = read_cache.user_details(conn, user_id)
+
+        # Fetch user's tweet count, following, and followers counts
+        counts = read_cache.user_counts(conn, user_id)
+
+        # Fetch up to 3 most recent tweets
+        recent_tweets = read_cache.recent_tweets(conn, user_id)
+
+        # Displaying the details
+        print(f"User ID: {user_id} Details:")
+        print(f"Name: {user_details[0]}")
+        print(f"Email: {user_details[1]}")
+        print(f"City: {user_details[2]}")
+        print(f"Timezone: {user_details[3]}")
+        print(f"Number of Tweets: {counts[0]}")
+        print(f"Number of Following: {counts[1]}")
+        print(f"Number of Followers: {counts[2]}")
+        print("Most Recent Tweets:")
+        for tweet in recent_tweets:
+            print(f"Tweet ID: {tweet[0]}, Tweet: {tweet[1]}")
+
+        # Actions
+        while True:  # Loop to allow user to go back
+            action = input("Choose 'follow' to follow this user, 'reply' to reply to a tweet, 'retweet' to retweet, 'tweets' to see more tweets, or 'back' to go back: ").strip().lower()
+            if action == 'follow':
+                follow_user(user_id)
+            elif action == 'reply':
+                tweet_id = input("Enter the Tweet ID you want to reply to: ").strip()
+                if tweet_id.isdigit():
+                    compose_reply(int(tweet_id), current_user_id)
+            elif action == 'retweet':
+                tweet_id = input("Enter the Tweet ID you want to retweet: ").strip()
+                if tweet_id.isdigit():
+                    retweet(int(tweet_id), current_user_id)
+            elif action == 'tweets':
+                display_more_tweets(user_id)
+            elif action == 'back':
+                return  # Go back to the screen that opened this one
+            else:
+                print("Invalid option.")
+
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+    return
+
+def follow_user(target_user_id):
+    try:
+        queries.follow(conn, current_user_id, target_user_id)
+        conn.commit()
+        read_cache.on_follow(current_user_id, target_user_id)
+        if follow_graph is not None:
+            follow_graph.add(current_user_id, target_user_id)
+        print("You are now following the user.")
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+        conn.rollback()
+    return
+
+def display_more_tweets(user_id):
+    try:
+        # Assuming the user wants to see more than the 3 most recent tweets.
+        # Pages are read as they are shown, keyed on the (date, tid) of the last tweet.
+        tweet_pages = queries.pages(lambda after, limit: archive.user_tweets_page(conn, user_id, after, limit=limit),
+                                    lambda tweet: (tweet[2], tweet[0]))
+        for tweets, more in tweet_pages:
+            for tweet in tweets:
+                print(f"Tweet ID: {tweet[0]}, Tweet: {tweet[1]}")
+
+            if not more:
+                break
+            cont = input("Show more tweets? (y/n): ").strip().lower()
+            if cont != 'y':
+                return
+        print("End of tweets.")
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+    return
+
+def compose_tweet(usr):
+    try:
+        tweet_text = input("Compose your tweet (hashtags with #): ")
+
+        # The tweet, its hashtags and mentions go in one transaction
+        queries.post_tweet(conn, usr, tweet_text)
+        conn.commit()
+        read_cache.on_tweet(usr)
+
+        print("Tweet posted successfully!")
+        
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e.args[0]}")
+        conn.rollback()
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        conn.rollback()
+    return  # Back to the user interface loop
+
+def list_followers(usr):
+    try:
+        # Followers are read a page at a time, keyed on the follower's user id
+        follower_pages = queries.pages(lambda after, limit: queries.followers_page(conn, usr, after, limit),
+                                       lambda follower: follower[0], limit=10)
+
+        # Display followers
+        print("Your followers:")
+        shown = 0
+        for followers, more in follower_pages:
+            for idx, follower in enumerate(followers, start=shown):
+                print(f"{idx + 1}. {follower[1]} (User ID: {follower[0]})")
+
+            # Handle follower selection
+            if more:
+                selection = input("Select a follower to view more info, 'n' for more followers, or type 'back' to return: ")
+                if selection.lower() == 'n':
+                    shown += len(followers)
+                    continue
+            else:
+                selection = input("Select a follower to view more info, or type 'back' to return: ")
+            if selection.lower() == 'back':
+                return
+            selected_idx = int(selection) - 1 - shown
+            if not 0 <= selected_idx < len(followers):
+                raise IndexError("no follower with that number on this page")
+            selected_usr = followers[selected_idx][0]
+            break
+        else:
+            print("You have no followers yet.")
+            return
+
+        # Fetch additional information about the follower
+        num_tweets, num_following, num_followers = read_cache.user_counts(conn, selected_usr)
+
+        recent_tweets = read_cache.recent_tweets(conn, selected_usr)
+
+        # Display the follower information
+        print(f"User ID: {selected_usr}")
+        print(f"Number of tweets: {num_tweets}")
+        print(f"Following: {num_following}")
+        print(f"Followers: {num_followers}")
+        print("Most recent tweets:")
+        for tweet in recent_tweets:
+            print(f"Tweet ID: {tweet[0]}, Date: {show_time(tweet[2])}, Tweet: {tweet[1]}")
+
+        # Handle tweet interaction
+        action = input("Select a tweet to reply (R) / retweet (RT) or type 'follow' to follow this user: ")
+        if action.lower() == "r":
+            tweet_id = input("Enter the Tweet ID to reply to: ")
+            if tweet_id.isdigit():
+                compose_reply(int(tweet_id), usr)
+            else:
+                print("Invalid Tweet ID. Please enter a numeric value.")
+        elif action.lower() == "rt":
+            tweet_id = input("Enter the Tweet ID to retweet: ")
+            if tweet_id.isdigit():
+                retweet(int(tweet_id), usr)
+            else:
+                print("Invalid Tweet ID. Please enter a numeric value.")
+        elif action.lower() == "follow":
+            follow_user(selected_usr)
+        else:
+            print("Invalid action. Please enter 'R' to reply, 'RT' to retweet, or 'follow' to follow the user.")
+
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e.args[0]}")
+        conn.rollback()
+    except ValueError as e:
+        print(f"A value error occurred: {e}")
+    except IndexError as e:
+        print(f"An index error occurred: {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+    return  # Back to the user interface loop
+
+def logout():
+    print("You have been logged out.")
+    return
+
+def display_tweets_for_user(user_id):
+    try:
+        # Keyset pagination: only the key of the page being moved away from is carried
+        page = 0
+        after = before = None
+        while True:
+            tweets = queries.feed_page(conn, user_id, after, before)
+            if not tweets:
+                if page == 0:
+                    print("You have no tweets to display.")
+                else:
+                    print("No more tweets to display.")
+                # Add an input here to allow the user to go back to the main menu
+                input("Press any key to return to the main menu...")
+                return  # This will exit the function and continue with the main loop
+
+            for idx, tweet in enumerate(tweets, start=1):
+                print(f"{idx}. {tweet[1]} (Date: {show_time(tweet[2])})")
+
+            tweet_selection = input("Select a tweet number to view statistics, 'n' to see more tweets, 'p' for the previous page, or 'b' to go back: ")
+            if tweet_selection.lower() == 'n':
+                # Display next page of tweets
+                after, before = (tweets[-1][2], tweets[-1][0]), None
+                page += 1
+            elif tweet_selection.lower() == 'p':
+                if page == 0:
+                    print("You are already on the first page.")
+                    continue
+                after, before = None, (tweets[0][2], tweets[0][0])
+                page -= 1
+            elif tweet_selection.lower() == 'b':
+                # User chooses to go back to the main menu
+                return
+            elif tweet_selection.isdigit() and 0 < int(tweet_selection) <= len(tweets):
+                # Selected a tweet, now get tweet statistics and interact
+                selected_tweet_id = tweets[int(tweet_selection) - 1][0]
+                display_tweet_statistics(selected_tweet_id)
+                interact_with_tweet(selected_tweet_id, user_id)
+                return
+            else:
+                print("Invalid selection. Please try again.")
+                return
+
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+    return
+
+def display_tweet_statistics(tweet_id):
+    try:
+        # Retrieve tweet statistics
+        stats = read_cache.tweet_counts(conn, tweet_id)
+        print(f"Retweets: {stats[0]}, Replies: {stats[1]}")
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+    return
+
+def display_thread(tweet_id, user_id):
+    try:
+        # Ancestors, the tweet (marked with '>') and all replies under it, indented by depth
+        thread = archive.thread(conn, tweet_id)
+        if not thread:
+            print("Tweet not found.")
+            return
+        for tid, writer, tdate, text, depth, replies in thread:
+            marker = '>' if tid == tweet_id else ' '
+            print(f"{marker} {'  ' * depth}[{tid}] {text} (User: {writer}, Date: {show_time(tdate)}, Replies: {replies})")
+
+        reply_to = input("Enter a Tweet ID from the thread to reply to it, or press Enter to go back: ").strip()
+        if reply_to.isdigit() and any(row[0] == int(reply_to) for row in thread):
+            compose_reply(int(reply_to), user_id)
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+    return
+
+def interact_with_tweet(tweet_id, user_id):
+    print("1. Reply to Tweet")
+    print("2. Retweet")
+    print("3. View conversation")
+    action = input("Choose an action (1-3) or press any other key to go back: ")
+    if action == '1':
+        compose_reply(tweet_id, user_id)
+    elif action == '2':
+        retweet(tweet_id, user_id)
+    elif action == '3':
+        display_thread(tweet_id, user_id)
+    return
+
+def compose_reply(tweet_id, user_id):
+    reply_text = input("Type your reply (or type 'back' to go back): ")
+    if reply_text.lower() == 'back':
+        return
+    try:
+        # Insert the reply into the tweets table, with reply_to field set to the original tweet's ID
+        queries.post_tweet(conn, user_id, reply_text, replyto=tweet_id)
+        conn.commit()
+        read_cache.on_tweet(user_id, tweet_id)
+        print("Your reply was posted successfully.")
+
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+        conn.rollback()
+    return  # Back to the screen the reply was started from
+
+def retweet(tweet_id, user_id):
+    # Confirm retweet action
+    confirm = input("Press 'y' to retweet or 'back' to go back: ")
+    if confirm.lower() == 'back':
+        return
+    elif confirm.lower() == 'y':
+        try:
+            # Insert the retweet into the retweets table
+            queries.retweet(conn, user_id, tweet_id)
+            conn.commit()
+            read_cache.on_retweet(user_id, tweet_id)
+            print("The tweet was retweeted successfully.")
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            conn.rollback()
+    return  # Back to the screen the retweet was started from
+
+def trending_hashtags(user_id):
+    try:
+        # Last 24 hours from the hourly hashtag counts, newer mentions weigh more
+        trends = queries.trending(conn, limit=10, hours=24, half_life=6)
+        if not trends:
+            print("Nothing is trending right now.")
+            return
+        print("Trending hashtags:")
+        for idx, (term, score) in enumerate(trends, start=1):
+            print(f"{idx}. #{term} (Score: {score:.1f})")
+
+        selection = input("Select a hashtag number to see its tweets, or 'b' to go back: ")
+        if selection.isdigit() and 1 <= int(selection) <= len(trends):
+            search_tweets(user_id, ['#' + trends[int(selection) - 1][0]])
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+    return
+
+def who_to_follow(user_id):
+    global follow_graph
+    try:
+        # Built from the snapshot file if there is one, then kept up to date
+        if follow_graph is None:
+            import graph
+            follow_graph = graph.load_or_build(conn, graph.snapshot_path(db.path))
+        follow_graph.refresh(conn)
+        suggestions = follow_graph.recommend(user_id, limit=10)
+        if not suggestions:
+            print("No suggestions right now.")
+            return
+        names = queries.user_names(conn, [candidate for candidate, mutual in suggestions])
+        print("Who to follow:")
+        for idx, (candidate, mutual) in enumerate(suggestions, start=1):
+            print(f"{idx}. {names.get(candidate)} (User ID: {candidate}, followed by {mutual} you follow)")
+
+        selection = input("Select a number to view the user, or 'b' to go back: ")
+        if selection.isdigit() and 1 <= int(selection) <= len(suggestions):
+            display_user_details(suggestions[int(selection) - 1][0])
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+    return
+
+NOTIFICATION_TEXT = {'reply': "replied to you", 'retweet': "retweeted your tweet", 'follow': "followed you"}
+
+def show_notifications(user_id):
+    try:
+        # Newest first, a page at a time, keyed on the notification id
+        notification_pages = queries.pages(lambda after, limit: queries.notifications_page(conn, user_id, after, limit),
+                                           lambda notification: notification[0], limit=10)
+        shown = 0
+        for notifications, more in notification_pages:
+            if shown == 0:
+                # Opening the inbox marks everything in it as read
+                queries.mark_notifications_read(conn, user_id, notifications[0][0])
+                conn.commit()
+            for idx, (nid, kind, actor, name, tid, text, ndate_ms) in enumerate(notifications, start=shown + 1):
+                about = f": {text}" if text else ""
+                print(f"{idx}. {name} (User ID: {actor}) {NOTIFICATION_TEXT[kind]}{about} (Date: {show_time(ndate_ms)})")
+
+            if more:
+                selection = input("Select a notification to open it, 'n' for older ones, or 'b' to go back: ").strip().lower()
+                if selection == 'n':
+                    shown += len(notifications)
+                    continue
+            else:
+                selection = input("Select a notification to open it, or 'b' to go back: ").strip().lower()
+            if selection.isdigit() and shown < int(selection) <= shown + len(notifications):
+                nid, kind, actor, name, tid, text, ndate_ms = notifications[int(selection) - 1 - shown]
+                if tid is None:
+                    display_user_details(actor)
+                else:
+                    display_thread(tid, user_id)
+            return
+        else:
+            print("You have no notifications yet.")
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+        conn.rollback()
+    return
+
+def user_interface(user_id):
+    while True:
+        print("\n--- Welcome to the Twitter Clone! ---")        
+        print("\nOptions:")
+        print("d - Display tweets")
+        print("s - Search for tweets")
+        print("u - Search for users")
+        print("c - Compose a tweet")
+        print("l - List followers")
+        print("t - Trending hashtags")
+        print("r - Who to follow")
+        print("n - Notifications")
+        print("q - Logout")
+        
+        choice = input("Choose an option: ").lower()
+        
+        if choice == "s":
+            search_tweets(user_id)
+        elif choice == "u":
+            search_users(user_id)
+        elif choice == "d":
+            display_tweets_for_user(user_id)
+        elif choice == "c":
+            compose_tweet(user_id)
+        elif choice == "l":
+            list_followers(user_id)
+        elif choice == "t":
+            trending_hashtags(user_id)
+        elif choice == "r":
+            who_to_follow(user_id)
+        elif choice == "n":
+            show_notifications(user_id)
+        elif choice == "q":
+            logout()
+            return
+        else:
+            print("Invalid option, please try again.")
+    return
+
+# Main loop
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Twitter clone")
+    parser.add_argument('database', nargs='?', default=database, help="defaults to $TWITCLONE_DB")
+    # CPU time spent before main(): interpreter start and imports; see
+    # python -X importtime for the cost of each module
+    instrument.add('startup.imports', time.process_time())
+    args = parser.parse_args(argv)
+    if args.database is None:
+        parser.error("name a database file or set TWITCLONE_DB")
+    db.path = args.database
+
+    while True:
+        print("\n1. Login\n2. Register\n3. Exit")
+        user_choice = input("Choose an option: ")
+        
+        if user_choice == "1":
+            user_id = login()
+            if user_id:
+                user_interface(user_id)
+        elif user_choice == "2":
+            register()
+        elif user_choice == "3":
+            print("Exiting the program...")
+            exit()
+        else:
+            print("Invalid input, please try again.")
+
+if __name__ == "__main__":
+    main()
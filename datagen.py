@@ -0,0 +1,140 @@
+"""
+Synthetic Twitter clone databases for benchmarking.
+
+   python datagen.py <database> --tweets 100000 [--users N] [--seed 1]
+
+Generates a power-law follow graph (a few accounts followed by many, most by
+few), skewed tweet volume per writer, reply chains, Zipf-distributed hashtags
+and retweets, and loads them through bulk_io so memory stays flat from 10k to
+10M tweets. The same seed always gives the same database.
+"""
+
+import argparse
+import datetime
+import random
+
+import bulk_io
+import schema
+
+WORDS = ('the a an and of to in on for with at from by about today tonight new good great bad '
+         'coffee game music movie city weather traffic work school team win lost love hate '
+         'edmonton calgary toronto vancouver oilers flames snow rain sun morning night weekend').split()
+FIRST_NAMES = ('alex sam jordan taylor casey riley morgan jamie avery quinn drew blake '
+               'charlie emerson finley harper kai logan parker reese rowan sage').split()
+LAST_NAMES = ('smith brown lee wilson martin roy tremblay gagnon white chen singh patel '
+              'nguyen campbell anderson taylor thomas moore walker young').split()
+CITIES = ('Edmonton Calgary Toronto Vancouver Montreal Ottawa Winnipeg Halifax Regina Saskatoon '
+          'Victoria Kelowna Quebec Hamilton London Windsor').split()
+
+START = datetime.datetime(2020, 1, 1)
+
+
+def zipf_rank(rng, n):
+    # A 0-based rank below n with probability roughly proportional to 1 / (rank + 1),
+    # drawn in constant time and memory however large n is
+    return min(n - 1, int(n ** rng.random()) - 1)
+
+
+def users(count, seed):
+    rng = random.Random(seed)
+    for usr in range(1, count + 1):
+        yield {
+            'usr': usr,
+            'pwd': 'pw%d' % usr,
+            'name': '%s %s' % (rng.choice(FIRST_NAMES).title(), rng.choice(LAST_NAMES).title()),
+            'email': 'user%d@example.com' % usr,
+            'city': rng.choice(CITIES),
+            'timezone': rng.choice([-8, -7, -6, -5, -4, -3.5]),
+        }
+
+
+def follows(user_count, seed, mean_following=30):
+    # Out-degrees are Pareto distributed, followees are picked by Zipf popularity
+    rng = random.Random(seed + 1)
+    for flwer in range(1, user_count + 1):
+        degree = min(user_count - 1, int(rng.paretovariate(1.5) * mean_following / 3))
+        day = rng.randrange(365)
+        for rank in {zipf_rank(rng, user_count) for _ in range(degree)}:
+            flwee = rank + 1
+            if flwee != flwer:
+                yield {'flwer': flwer, 'flwee': flwee,
+                       'start_date': (START + datetime.timedelta(days=day)).strftime('%Y-%m-%d')}
+
+
+def tweet_stream(tweet_count, user_count, hashtag_count, seed, days=365, reply_rate=0.15):
+    # Yields (tweet row, hashtag terms). Writers are Zipf distributed in a different
+    # order from follow popularity; replies pick a recent tweet so chains form.
+    rng = random.Random(seed + 2)
+    writers = list(range(1, user_count + 1))
+    random.Random(seed + 3).shuffle(writers)
+    recent = []
+    step = days * 86400 / max(tweet_count, 1)
+    for tid in range(1, tweet_count + 1):
+        writer = writers[zipf_rank(rng, user_count)]
+        tdate = (START + datetime.timedelta(seconds=int(tid * step))).strftime('%Y-%m-%d %H:%M:%S')
+        replyto = rng.choice(recent) if recent and rng.random() < reply_rate else None
+        terms = sorted({'tag%d' % zipf_rank(rng, hashtag_count) for _ in range(rng.choice([0, 0, 1, 1, 2, 3]))})
+        words = rng.choices(WORDS, k=rng.randint(3, 12))
+        text = " ".join(words + ['#' + term for term in terms])
+        recent.append(tid)
+        if len(recent) > 1000:
+            recent.pop(0)
+        yield {'tid': tid, 'writer': writer, 'tdate': tdate, 'text': text, 'replyto': replyto}, terms
+
+
+def tweets(*args):
+    for tweet, terms in tweet_stream(*args):
+        yield tweet
+
+
+def mentions(*args):
+    for tweet, terms in tweet_stream(*args):
+        for term in terms:
+            yield {'tid': tweet['tid'], 'term': term}
+
+
+def retweets(tweet_count, user_count, seed, rate=0.3):
+    # A few early tweets collect most of the retweets
+    rng = random.Random(seed + 4)
+    for _ in range(int(tweet_count * rate)):
+        tid = zipf_rank(rng, tweet_count) + 1
+        yield {'usr': rng.randint(1, user_count), 'tid': tid,
+               'rdate': (START + datetime.timedelta(days=rng.randrange(365))).strftime('%Y-%m-%d')}
+
+
+def generate(conn, tweet_count, user_count=None, hashtag_count=None, seed=1):
+    user_count = user_count or max(10, tweet_count // 20)
+    hashtag_count = hashtag_count or max(10, tweet_count // 100)
+    stream_args = (tweet_count, user_count, hashtag_count, seed)
+    sources = {
+        'users': users(user_count, seed),
+        'hashtags': ({'term': 'tag%d' % k} for k in range(hashtag_count)),
+        'tweets': tweets(*stream_args),
+        'follows': follows(user_count, seed),
+        'retweets': retweets(tweet_count, user_count, seed),
+        'mentions': mentions(*stream_args),
+    }
+    # Random follows and retweets can repeat a pair; keep the first
+    return bulk_io.bulk_load(conn, sources, ignore_duplicates=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic Twitter clone database")
+    parser.add_argument('database')
+    parser.add_argument('--tweets', type=int, default=10000)
+    parser.add_argument('--users', type=int, help="defaults to one user per 20 tweets")
+    parser.add_argument('--hashtags', type=int, help="defaults to one hashtag per 100 tweets")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    conn = schema.connect(args.database)
+    try:
+        counts = generate(conn, args.tweets, args.users, args.hashtags, args.seed)
+        for table, count in counts.items():
+            print(f"{table}: {count} rows")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+In-memory follow graph for who-to-follow recommendations.
+
+   python graph.py build <database>              write the snapshot file
+   python graph.py recommend <database> <usr>    print suggestions for a user
+
+The follows table is held in compressed sparse row form: the ids followed by
+user u are targets[offsets[u]:offsets[u + 1]], in flat int arrays of about
+4 bytes per edge. Follows added later go to a small per-user overlay until the
+next compaction. A binary snapshot (<database>.graph) saves rebuilding the
+arrays on every start; follows committed after it was written are read back
+by rowid when it is loaded.
+
+Suggestions are the users followed by the people you follow (two hops away),
+scored by how many of them follow each candidate, then by follower count.
+"""
+
+import argparse
+import array
+import heapq
+import os
+import struct
+import sys
+import threading
+import time
+from collections import Counter
+
+import schema
+
+MAGIC = b'TWFG1'
+HEADER = struct.Struct('<5sc3q')  # magic, byte order, users, edges, last follows rowid
+
+
+def int_array(values=()):
+    return array.array('i', values)
+
+
+class FollowGraph:
+    def __init__(self, offsets, targets, followers, last_rowid=0):
+        self.offsets = offsets
+        self.targets = targets
+        self.followers = followers  # follower count per user id, one shorter than offsets
+        self.last_rowid = last_rowid
+        self.overlay = {}  # flwer -> int array of followees added since the last compaction
+        self.overlay_edges = 0
+        self._lock = threading.Lock()
+
+    @property
+    def edges(self):
+        return len(self.targets) + self.overlay_edges
+
+    @classmethod
+    def build(cls, conn):
+        max_usr = conn.execute('''
+            SELECT MAX(m) FROM (
+                SELECT MAX(usr) AS m FROM users
+                UNION ALL SELECT MAX(flwer) FROM follows
+                UNION ALL SELECT MAX(flwee) FROM follows
+            )
+        ''').fetchone()[0] or 0
+        last_rowid = conn.execute('SELECT MAX(rowid) FROM follows').fetchone()[0] or 0
+        offsets = int_array([0]) * (max_usr + 2)
+        targets = int_array()
+        followers = int_array([0]) * (max_usr + 1)
+        # Primary key order, so each user's followees arrive together
+        rows = conn.execute('SELECT flwer, flwee FROM follows WHERE rowid <= ? ORDER BY flwer, flwee',
+                            (last_rowid,))
+        for flwer, flwee in rows:
+            targets.append(flwee)
+            offsets[flwer + 1] += 1
+            followers[flwee] += 1
+        for usr in range(1, len(offsets)):
+            offsets[usr] += offsets[usr - 1]
+        return cls(offsets, targets, followers, last_rowid)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            magic, byteorder, users, edges, last_rowid = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a follow graph snapshot")
+            offsets, targets, followers = int_array(), int_array(), int_array()
+            offsets.fromfile(f, users + 1)
+            targets.fromfile(f, edges)
+            followers.fromfile(f, users)
+        if byteorder != sys.byteorder[0].encode():
+            for values in (offsets, targets, followers):
+                values.byteswap()
+        return cls(offsets, targets, followers, last_rowid)
+
+    def save(self, path):
+        with self._lock:
+            self._compact()
+            # Written beside the old snapshot and swapped in, so readers never see half a file
+            with open(path + '.tmp', 'wb') as f:
+                f.write(HEADER.pack(MAGIC, sys.byteorder[0].encode(), len(self.followers),
+                                    len(self.targets), self.last_rowid))
+                self.offsets.tofile(f)
+                self.targets.tofile(f)
+                self.followers.tofile(f)
+            os.replace(path + '.tmp', path)
+
+    def followees(self, usr):
+        if 0 <= usr < len(self.offsets) - 1:
+            found = self.targets[self.offsets[usr]:self.offsets[usr + 1]]
+        else:
+            found = int_array()
+        extra = self.overlay.get(usr)
+        return found + extra if extra else found
+
+    def follower_count(self, usr):
+        return self.followers[usr] if 0 <= usr < len(self.followers) else 0
+
+    def add(self, flwer, flwee):
+        # Records a new follow; repeats are ignored
+        with self._lock:
+            if flwee in self.followees(flwer):
+                return
+            self.overlay.setdefault(flwer, int_array()).append(flwee)
+            self.overlay_edges += 1
+            users = max(flwer, flwee) + 1
+            if users > len(self.followers):
+                self.followers.extend([0] * (users - len(self.followers)))
+            self.followers[flwee] += 1
+
+    def refresh(self, conn):
+        # Picks up follows committed since the graph was built, by this or any other process
+        rows = conn.execute('SELECT rowid, flwer, flwee FROM follows WHERE rowid > ? ORDER BY rowid',
+                            (self.last_rowid,)).fetchall()
+        for rowid, flwer, flwee in rows:
+            self.add(flwer, flwee)
+            self.last_rowid = rowid
+        return len(rows)
+
+    def _compact(self):
+        # Merges the overlay back into the flat arrays
+        if not self.overlay:
+            return
+        users = len(self.followers)
+        offsets, targets = int_array([0]) * (users + 1), int_array()
+        for usr in range(users):
+            targets.extend(self.followees(usr))
+            offsets[usr + 1] = len(targets)
+        self.offsets, self.targets = offsets, targets
+        self.overlay, self.overlay_edges = {}, 0
+
+    def recommend(self, usr, limit=10):
+        # [(candidate, followed by how many of usr's followees)], best first.
+        # Someone who follows nobody yet gets the most followed users.
+        following = self.followees(usr)
+        counts = Counter()
+        for followee in following:
+            counts.update(self.followees(followee))
+        for seen in following:
+            counts.pop(seen, None)
+        counts.pop(usr, None)
+        if not counts:
+            popular = heapq.nlargest(limit + len(following) + 1, range(len(self.followers)),
+                                     key=self.followers.__getitem__)
+            return [(candidate, 0) for candidate in popular
+                    if candidate != usr and candidate not in following and self.followers[candidate]][:limit]
+        return heapq.nlargest(limit, counts.items(), key=lambda item: (item[1], self.follower_count(item[0])))
+
+
+def snapshot_path(database):
+    return database + '.graph'
+
+
+def load_or_build(conn, path=None, resave_fraction=0.01):
+    # The snapshot at path if there is one that still matches the follows table,
+    # caught up with newer follows; otherwise a fresh build, saved to path
+    if path and os.path.exists(path):
+        try:
+            graph = FollowGraph.load(path)
+        except (OSError, ValueError, EOFError):
+            graph = None
+        if graph is not None:
+            added = graph.refresh(conn)
+            if conn.execute('SELECT COUNT(*) FROM follows').fetchone()[0] == graph.edges:
+                if added > graph.edges * resave_fraction:
+                    graph.save(path)
+                return graph
+    graph = FollowGraph.build(conn)
+    graph.refresh(conn)
+    if path:
+        graph.save(path)
+    return graph
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Follow graph snapshot and recommendations")
+    parser.add_argument('command', choices=['build', 'recommend'])
+    parser.add_argument('database')
+    parser.add_argument('usr', type=int, nargs='?')
+    parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    conn = schema.connect(args.database)
+    try:
+        started = time.perf_counter()
+        if args.command == 'build':
+            graph = FollowGraph.build(conn)
+            graph.save(snapshot_path(args.database))
+            print(f"{graph.edges} follows written to {snapshot_path(args.database)} "
+                  f"in {time.perf_counter() - started:.2f}s")
+            return
+        if args.usr is None:
+            parser.error("recommend needs a user id")
+        graph = load_or_build(conn, snapshot_path(args.database))
+        loaded = time.perf_counter()
+        suggestions = graph.recommend(args.usr, args.limit)
+        print(f"graph ready in {(loaded - started) * 1000:.1f} ms, "
+              f"scored in {(time.perf_counter() - loaded) * 1000:.2f} ms")
+        for candidate, mutual in suggestions:
+            print(f"{candidate}: followed by {mutual} you follow, {graph.follower_count(candidate)} followers")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Query instrumentation for the Twitter clone.
+
+Set TWITCLONE_PROFILE=1 to open connections with InstrumentedConnection. Every
+statement is then timed (execute plus fetches) and its rows counted under a
+label for its call site, which is the function that ran it, e.g.
+'queries.feed_page'. Code can choose its own label with 'with label("feed"):'.
+
+Statements slower than TWITCLONE_SLOW_MS (default 50) are written to the slow
+query log at TWITCLONE_SLOW_LOG (default slow_queries.log) with their
+parameters and EXPLAIN QUERY PLAN. Per-label totals are printed to stderr at
+exit and whenever the process receives SIGUSR1.
+
+Startup costs are reported under 'startup.*' labels next to the statements:
+'startup.connect' is opening and migrating the database in the CLI and batch
+mode, 'startup.imports' the CPU time the CLI used before main() started.
+"""
+
+import atexit
+import contextlib
+import contextvars
+import os
+import signal
+import sqlite3
+import sys
+import threading
+import time
+import weakref
+
+slow_ms = float(os.environ.get('TWITCLONE_SLOW_MS', 50))
+
+_label = contextvars.ContextVar('label', default=None)
+_lock = threading.Lock()
+_stats = {}  # label -> [calls, seconds, max seconds, rows, slow calls]
+_explained = set()
+_pending = weakref.WeakSet()  # cursors whose last statement has not been recorded yet
+_installed = False
+
+
+@contextlib.contextmanager
+def label(name):
+    token = _label.set(name)
+    try:
+        yield
+    finally:
+        _label.reset(token)
+
+
+def call_site():
+    # The first function on the stack outside this module
+    frame = sys._getframe(2)
+    while frame.f_globals.get('__name__') == __name__:
+        frame = frame.f_back
+    return f"{frame.f_globals.get('__name__')}.{frame.f_code.co_name}"
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    _record = None
+
+    def execute(self, sql, parameters=()):
+        self._begin(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._add(time.perf_counter() - started, max(self.rowcount, 0))
+
+    def executemany(self, sql, seq_of_parameters):
+        self._begin(sql, ())
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._add(time.perf_counter() - started, max(self.rowcount, 0))
+            self._finish()
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._add(time.perf_counter() - started, row is not None)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._add(time.perf_counter() - started, len(rows))
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._add(time.perf_counter() - started, len(rows))
+        self._finish()
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._finish()
+            raise
+        self._add(time.perf_counter() - started, 1)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+    def _begin(self, sql, parameters):
+        self._finish()
+        # [label, sql, parameters, seconds, rows]
+        self._record = [_label.get() or call_site(), sql, parameters, 0.0, 0]
+        _pending.add(self)
+
+    def _add(self, seconds, rows):
+        if self._record is not None:
+            self._record[3] += seconds
+            self._record[4] += rows
+
+    def _finish(self):
+        record, self._record = self._record, None
+        if record is None:
+            return
+        name, sql, parameters, seconds, rows = record
+        slow = seconds * 1000 >= slow_ms
+        add(name, seconds, rows, slow)
+        if slow:
+            log_slow(self.connection, name, sql, parameters, seconds, rows)
+
+
+def add(name, seconds, rows=0, slow=False):
+    # Counts one call under a label; also for timings that are not statements
+    with _lock:
+        entry = _stats.setdefault(name, [0, 0.0, 0.0, 0, 0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+        entry[3] += rows
+        entry[4] += slow
+
+
+def log_slow(conn, name, sql, parameters, seconds, rows):
+    message = f"{seconds * 1000:.1f} ms, {rows} rows [{name}] {' '.join(sql.split())} {tuple(parameters)}"
+    # The plan is captured once per distinct statement
+    key = (name, sql)
+    if key not in _explained and sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+        _explained.add(key)
+        try:
+            plan = sqlite3.Connection.execute(conn, 'EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+            message += "".join(f"\n    {'  ' * depth(plan, row)}{row[3]}" for row in plan)
+        except sqlite3.Error as e:
+            message += f"\n    (no plan: {e})"
+    # logging is only imported once something is slow enough to log
+    import logging
+    logging.getLogger('twitclone.slow').warning(message)
+
+
+def depth(plan, row):
+    parents = {node[0]: node[1] for node in plan}
+    level, parent = 0, row[1]
+    while parent in parents:
+        level, parent = level + 1, parents[parent]
+    return level
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def stats():
+    with _lock:
+        return {name: list(entry) for name, entry in _stats.items()}
+
+
+def report():
+    lines = [f"{'label':<40}{'calls':>8}{'total ms':>11}{'avg ms':>9}{'max ms':>9}{'rows':>9}{'slow':>6}"]
+    for name, (calls, seconds, longest, rows, slow) in sorted(stats().items(), key=lambda item: -item[1][1]):
+        lines.append(f"{name:<40}{calls:>8}{seconds * 1000:>11.1f}{seconds * 1000 / calls:>9.2f}"
+                     f"{longest * 1000:>9.2f}{rows:>9}{slow:>6}")
+    return "\n".join(lines)
+
+
+def dump(*args):
+    print(report(), file=sys.stderr)
+
+
+def dump_at_exit():
+    # Statements whose results were never read to the end are recorded now
+    for cursor in list(_pending):
+        cursor._finish()
+    dump()
+
+
+def install():
+    # Slow query log handler, dump at exit and on SIGUSR1; safe to call more than once
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    import logging
+    slow_log = logging.getLogger('twitclone.slow')
+    # delay: the file is only created once a statement is slow
+    handler = logging.FileHandler(os.environ.get('TWITCLONE_SLOW_LOG', 'slow_queries.log'), delay=True)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    slow_log.addHandler(handler)
+    slow_log.propagate = False
+    atexit.register(dump_at_exit)
+    if hasattr(signal, 'SIGUSR1') and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, dump)
+
+
+def connection_factory():
+    # What to pass to sqlite3.connect(factory=...)
+    if not os.environ.get('TWITCLONE_PROFILE'):
+        return sqlite3.Connection
+    install()
+    return InstrumentedConnection
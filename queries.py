@@ -0,0 +1,432 @@
+"""
+Non-interactive query functions shared by the CLI and the maintenance tools.
+Every function takes an open sqlite3 connection as its first argument.
+
+Paged queries use keyset pagination on (date, tid): pass the key of the last
+row of a page as 'after' to get the next page, or the key of the first row
+as 'before' to get the previous one. Pages are always returned newest first.
+Dates in rows and keys are integer milliseconds since 1970-01-01 UTC; use
+local_time() to show them.
+"""
+
+import datetime
+import heapq
+import time
+
+import schema
+
+
+def seek(date_col, tid_col, after=None, before=None):
+    # Returns the WHERE condition, sort direction and parameters for one keyset page
+    if before is not None:
+        return f"({date_col}, {tid_col}) > (?, ?)", 'ASC', list(before)
+    if after is not None:
+        return f"({date_col}, {tid_col}) < (?, ?)", 'DESC', list(after)
+    return "1", 'DESC', []
+
+
+def newest_first(rows, before=None):
+    # Pages read backwards come out oldest first
+    return rows[::-1] if before is not None else rows
+
+
+def now_ms():
+    return time.time_ns() // 1000000
+
+
+def utc_text(ms):
+    # The text form still written beside every millisecond time
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ms // 1000))
+
+
+def local_time(ms, timezone=None):
+    # 'YYYY-MM-DD HH:MM' for a millisecond time, at a user's timezone (hours from UTC)
+    if ms is None:
+        return None
+    try:
+        zone = datetime.timezone(datetime.timedelta(hours=float(timezone or 0)))
+    except (TypeError, ValueError):
+        zone = datetime.timezone.utc
+    return datetime.datetime.fromtimestamp(ms / 1000, zone).strftime('%Y-%m-%d %H:%M')
+
+
+def pages(fetch, key, limit=5):
+    # Yields (page, more) for the successive pages of fetch(after, limit), where
+    # key(row) is the 'after' key of a row. The next page is read before the
+    # current one is handed out, so 'more' is known and the next page shows up
+    # at once; no more than two pages are ever held.
+    page = fetch(None, limit)
+    while page:
+        following = fetch(key(page[-1]), limit) if len(page) == limit else []
+        yield page, bool(following)
+        page = following
+
+
+def search_expression(keywords):
+    # Keywords are OR-ed together like the old LIKE chain. A '#term' keyword only
+    # matches tweets mentioning that hashtag, anything else is a prefix match on the text.
+    terms = []
+    for keyword in keywords:
+        if keyword.startswith('#') and len(keyword) > 1:
+            terms.append('terms : "%s"' % keyword[1:].replace('"', '""'))
+        else:
+            terms.append('"%s"*' % keyword.replace('"', '""'))
+    return " OR ".join(terms)
+
+
+def search_tweets_page(conn, keywords, after=None, before=None, limit=5, db='main'):
+    # Rows are (tid, writer, tdate_ms, text); the page key is (tdate_ms, tid).
+    # db names an attached archive database to search instead of the main one.
+    condition, direction, params = seek('t.tdate_ms', 't.tid', after, before)
+    rows = conn.execute(f'''
+        SELECT t.tid, t.writer, t.tdate_ms, t.text
+        FROM {db}.tweets_fts(?) f
+        JOIN {db}.tweets t ON t.tid = f.rowid
+        WHERE {condition}
+        ORDER BY t.tdate_ms {direction}, t.tid {direction}
+        LIMIT ?
+    ''', [search_expression(keywords)] + params + [limit]).fetchall()
+    return newest_first(rows, before)
+
+
+def feed_page(conn, user_id, after=None, before=None, limit=5):
+    # Tweets and retweets of followed users. Rows are (tid, text, date); the page key is (date, tid)
+    if timeline_fanout_limit(conn) is not None:
+        return timeline_page(conn, user_id, after, before, limit)
+    tweet_condition, direction, params = seek('t.tdate_ms', 't.tid', after, before)
+    retweet_condition = seek('r.rdate_ms', 'r.tid', after, before)[0]
+    rows = conn.execute(f'''
+        SELECT tid, text, tdate_ms FROM (
+            SELECT t.tid, t.text, t.tdate_ms
+            FROM tweets t
+            JOIN follows f ON t.writer = f.flwee
+            WHERE f.flwer = ? AND {tweet_condition}
+            UNION
+            SELECT r.tid, t.text, r.rdate_ms
+            FROM retweets r
+            JOIN tweets t ON r.tid = t.tid
+            JOIN follows f ON t.writer = f.flwee
+            WHERE f.flwer = ? AND {retweet_condition}
+        )
+        ORDER BY tdate_ms {direction}, tid {direction}
+        LIMIT ?
+    ''', [user_id] + params + [user_id] + params + [limit]).fetchall()
+    return newest_first(rows, before)
+
+
+def timeline_fanout_limit(conn):
+    # None while the materialized timeline is switched off
+    row = conn.execute("SELECT value FROM meta WHERE key = 'timeline_fanout_limit'").fetchone()
+    return row[0] if row else None
+
+
+def timeline_page(conn, user_id, after=None, before=None, limit=5):
+    # One range scan of the user's timeline, merged with the writers that are read on demand
+    timeline_condition, direction, params = seek('tl.tdate_ms', 'tl.tid', after, before)
+    tweet_condition = seek('t.tdate_ms', 't.tid', after, before)[0]
+    retweet_condition = seek('r.rdate_ms', 'r.tid', after, before)[0]
+    rows = conn.execute(f'''
+        SELECT tid, text, tdate_ms FROM (
+            SELECT * FROM (
+                SELECT tl.tid, t.text, tl.tdate_ms
+                FROM timeline tl
+                JOIN tweets t ON t.tid = tl.tid
+                WHERE tl.usr = ? AND {timeline_condition}
+                ORDER BY tl.tdate_ms {direction}, tl.tid {direction}
+                LIMIT ?
+            )
+            UNION
+            SELECT * FROM (
+                SELECT t.tid, t.text, t.tdate_ms
+                FROM follows f
+                JOIN timeline_pull p ON p.usr = f.flwee
+                JOIN tweets t ON t.writer = f.flwee
+                WHERE f.flwer = ? AND {tweet_condition}
+                ORDER BY t.tdate_ms {direction}, t.tid {direction}
+                LIMIT ?
+            )
+            UNION
+            SELECT * FROM (
+                SELECT r.tid, t.text, r.rdate_ms
+                FROM follows f
+                JOIN timeline_pull p ON p.usr = f.flwee
+                JOIN tweets t ON t.writer = f.flwee
+                JOIN retweets r ON r.tid = t.tid
+                WHERE f.flwer = ? AND {retweet_condition}
+                ORDER BY r.rdate_ms {direction}, r.tid {direction}
+                LIMIT ?
+            )
+        )
+        ORDER BY tdate_ms {direction}, tid {direction}
+        LIMIT ?
+    ''', [user_id] + params + [limit, user_id] + params + [limit, user_id] + params + [limit, limit]).fetchall()
+    return newest_first(rows, before)
+
+
+def is_pull_writer(conn, writer):
+    return conn.execute('SELECT 1 FROM timeline_pull WHERE usr = ?', (writer,)).fetchone() is not None
+
+
+def fan_out_tweet(conn, tid):
+    # Push a newly written tweet or reply into its writer's followers' timelines
+    if timeline_fanout_limit(conn) is None:
+        return
+    conn.execute('''
+        INSERT OR IGNORE INTO timeline (usr, tdate_ms, tid)
+        SELECT f.flwer, t.tdate_ms, t.tid
+        FROM tweets t
+        JOIN follows f ON f.flwee = t.writer
+        WHERE t.tid = ? AND t.writer NOT IN (SELECT usr FROM timeline_pull)
+    ''', (tid,))
+
+
+def fan_out_retweet(conn, usr, tid):
+    # The feed shows retweets of followed writers' tweets, so a retweet goes to the original writer's followers
+    if timeline_fanout_limit(conn) is None:
+        return
+    conn.execute('''
+        INSERT OR IGNORE INTO timeline (usr, tdate_ms, tid)
+        SELECT f.flwer, r.rdate_ms, r.tid
+        FROM retweets r
+        JOIN tweets t ON t.tid = r.tid
+        JOIN follows f ON f.flwee = t.writer
+        WHERE r.usr = ? AND r.tid = ? AND t.writer NOT IN (SELECT usr FROM timeline_pull)
+    ''', (usr, tid))
+
+
+def fan_out_follow(conn, flwer, flwee):
+    # Backfill a new follower's timeline, or switch the followee to read-on-demand
+    # once they have too many followers to fan out to
+    fanout_limit = timeline_fanout_limit(conn)
+    if fanout_limit is None or is_pull_writer(conn, flwee):
+        return
+    if user_counts(conn, flwee)[2] >= fanout_limit:
+        conn.execute('INSERT OR IGNORE INTO timeline_pull (usr) VALUES (?)', (flwee,))
+        return
+    conn.execute('''
+        INSERT OR IGNORE INTO timeline (usr, tdate_ms, tid)
+        SELECT ?, tdate_ms, tid FROM tweets WHERE writer = ?
+    ''', (flwer, flwee))
+    conn.execute('''
+        INSERT OR IGNORE INTO timeline (usr, tdate_ms, tid)
+        SELECT ?, r.rdate_ms, r.tid
+        FROM tweets t
+        JOIN retweets r ON r.tid = t.tid
+        WHERE t.writer = ?
+    ''', (flwer, flwee))
+
+
+def search_users(conn, keyword, after=None, limit=5):
+    # One page of users whose name contains the keyword, shortest name first,
+    # then users whose city contains it, shortest city first. Rows are
+    # (usr, name, city, group, length); pass user_search_key() of the last row
+    # as 'after' for the next page.
+    after = after or (-1, -1, -1)
+    if len(keyword) >= 3:
+        # The trigram index can only look up substrings of three or more characters
+        phrase = '"' + keyword.replace('"', '""') + '"'
+        return conn.execute('''
+            SELECT usr, name, city, grp, len FROM (
+                SELECT u.usr, u.name, u.city, 0 AS grp, LENGTH(u.name) AS len
+                FROM users_fts(?) f JOIN users u ON u.usr = f.rowid
+                UNION ALL
+                SELECT u.usr, u.name, u.city, 1, LENGTH(u.city)
+                FROM users_fts(?) f JOIN users u ON u.usr = f.rowid
+            )
+            WHERE (grp, len, usr) > (?, ?, ?)
+            ORDER BY grp, len, usr
+            LIMIT ?
+        ''', (f'name : {phrase}', f'city : {phrase} NOT name : {phrase}', *after, limit)).fetchall()
+    pattern = f"%{keyword}%".lower()
+    return conn.execute('''
+        SELECT usr, name, city, grp, len FROM (
+            SELECT usr, name, city, 0 AS grp, LENGTH(name) AS len FROM users
+            WHERE LOWER(name) LIKE ?
+            UNION ALL
+            SELECT usr, name, city, 1, LENGTH(city) FROM users
+            WHERE LOWER(name) NOT LIKE ? AND LOWER(city) LIKE ?
+        )
+        WHERE (grp, len, usr) > (?, ?, ?)
+        ORDER BY grp, len, usr
+        LIMIT ?
+    ''', (pattern, pattern, pattern, *after, limit)).fetchall()
+
+
+def user_search_key(row):
+    return (row[3], row[4], row[0])
+
+
+def user_tweets_page(conn, usr, after=None, before=None, limit=5, db='main'):
+    # Tweets written by usr. Rows are (tid, text, tdate_ms); the page key is (tdate_ms, tid)
+    condition, direction, params = seek('tdate_ms', 'tid', after, before)
+    rows = conn.execute(f'''
+        SELECT tid, text, tdate_ms FROM {db}.tweets
+        WHERE writer = ? AND {condition}
+        ORDER BY tdate_ms {direction}, tid {direction}
+        LIMIT ?
+    ''', [usr] + params + [limit]).fetchall()
+    return newest_first(rows, before)
+
+
+def followers_page(conn, usr, after=None, limit=5):
+    # Rows are (usr, name) in follower id order; the page key is the follower's usr
+    return conn.execute('''
+        SELECT u.usr, u.name
+        FROM follows f
+        JOIN users u ON u.usr = f.flwer
+        WHERE f.flwee = ? AND f.flwer > ?
+        ORDER BY f.flwer
+        LIMIT ?
+    ''', (usr, -1 if after is None else after, limit)).fetchall()
+
+
+def thread(conn, tid, db='main'):
+    # The conversation around a tweet, read with one range scan of its thread:
+    # the tweet's ancestors from the root down, the tweet, then every reply
+    # below it depth first. Rows are (tid, writer, tdate_ms, text, depth, replies),
+    # where replies counts all the replies under that tweet, not just direct ones.
+    rows = conn.execute(f'''
+        SELECT tid, writer, tdate_ms, text, replyto, depth FROM {db}.tweets
+        WHERE root = (SELECT root FROM {db}.tweets WHERE tid = ?)
+        ORDER BY tid
+    ''', (tid,)).fetchall()
+    tweets = {row[0]: row for row in rows}
+    if tid not in tweets:
+        return []
+    children = {}
+    replies = dict.fromkeys(tweets, 0)
+    for row in rows:
+        children.setdefault(row[4], []).append(row[0])
+    # Deepest first, so every subtree is totalled before its parent reads it
+    for row in sorted(rows, key=lambda row: -row[5]):
+        if row[4] in replies:
+            replies[row[4]] += replies[row[0]] + 1
+    ancestors = []
+    parent = tweets[tid][4]
+    while parent in tweets:
+        ancestors.append(parent)
+        parent = tweets[parent][4]
+    order = ancestors[::-1]
+    stack = [tid]
+    while stack:
+        current = stack.pop()
+        order.append(current)
+        stack.extend(reversed(children.get(current, [])))
+    return [(t, tweets[t][1], tweets[t][2], tweets[t][3], tweets[t][5], replies[t]) for t in order]
+
+
+def user_names(conn, usrs):
+    # {usr: name} for a handful of user ids
+    usrs = list(usrs)
+    return dict(conn.execute(f'''
+        SELECT usr, name FROM users WHERE usr IN ({", ".join("?" * len(usrs))})
+    ''', usrs).fetchall())
+
+
+def user_details(conn, usr):
+    return conn.execute('SELECT name, email, city, timezone FROM users WHERE usr = ?', (usr,)).fetchone()
+
+
+def recent_tweets(conn, usr, limit=3):
+    return conn.execute('''
+        SELECT tid, text, tdate_ms FROM tweets WHERE writer = ? ORDER BY tdate_ms DESC, tid DESC LIMIT ?
+    ''', (usr, limit)).fetchall()
+
+
+def hashtags_in(text):
+    # Hashtags in the order they first appear, without duplicates
+    return list(dict.fromkeys(word[1:] for word in text.split() if word.startswith('#') and len(word) > 1))
+
+
+def post_tweet(conn, writer, text, replyto=None, tdate_ms=None):
+    # Writes the tweet, its hashtags and mentions without committing, so the caller
+    # decides what else shares the transaction. Returns the new tid.
+    tdate_ms = now_ms() if tdate_ms is None else tdate_ms
+    tid = conn.execute('''
+        INSERT INTO tweets (writer, tdate, tdate_ms, text, replyto)
+        VALUES (?, ?, ?, ?, ?)
+        RETURNING tid
+    ''', (writer, utc_text(tdate_ms), tdate_ms, text, replyto)).fetchone()[0]
+    hashtags = [(term,) for term in hashtags_in(text)]
+    conn.executemany('INSERT OR IGNORE INTO hashtags (term) VALUES (?)', hashtags)
+    conn.executemany('INSERT INTO mentions (tid, term) VALUES (?, ?)', [(tid, term) for term, in hashtags])
+    fan_out_tweet(conn, tid)
+    return tid
+
+
+def retweet(conn, usr, tid):
+    rdate_ms = now_ms()
+    conn.execute('INSERT INTO retweets (usr, tid, rdate, rdate_ms) VALUES (?, ?, ?, ?)',
+                 (usr, tid, utc_text(rdate_ms), rdate_ms))
+    fan_out_retweet(conn, usr, tid)
+
+
+def follow(conn, flwer, flwee):
+    start_ms = now_ms()
+    conn.execute('INSERT INTO follows (flwer, flwee, start_date, start_ms) VALUES (?, ?, ?, ?)',
+                 (flwer, flwee, utc_text(start_ms), start_ms))
+    fan_out_follow(conn, flwer, flwee)
+
+
+def user_counts(conn, usr):
+    # (tweets, following, followers) from the trigger-maintained counters
+    row = conn.execute('SELECT tweets, following, followers FROM user_stats WHERE usr = ?', (usr,)).fetchone()
+    return row if row else (0, 0, 0)
+
+
+def tweet_counts(conn, tid):
+    # (retweets, replies) from the trigger-maintained counters
+    row = conn.execute('SELECT retweets, replies FROM tweet_stats WHERE tid = ?', (tid,)).fetchone()
+    return row if row else (0, 0)
+
+
+def unread_count(conn, usr):
+    # Notifications usr has not read yet, from the trigger-maintained inbox
+    row = conn.execute('SELECT unread FROM inbox WHERE usr = ?', (usr,)).fetchone()
+    return row[0] if row else 0
+
+
+def notifications_page(conn, usr, after=None, limit=5):
+    # Newest first. Rows are (nid, kind, actor, actor name, tid, text, ndate_ms),
+    # where kind is 'reply', 'retweet' or 'follow' and text is the reply or the
+    # retweeted tweet (None for follows and archived tweets); the page key is nid.
+    condition, params = ("n.nid < ?", [after]) if after is not None else ("1", [])
+    return conn.execute(f'''
+        SELECT n.nid, n.kind, n.actor, u.name, n.tid, t.text, n.ndate_ms
+        FROM notifications n
+        LEFT JOIN users u ON u.usr = n.actor
+        LEFT JOIN tweets t ON t.tid = n.tid
+        WHERE n.usr = ? AND {condition}
+        ORDER BY n.nid DESC
+        LIMIT ?
+    ''', [usr] + params + [limit]).fetchall()
+
+
+def mark_notifications_read(conn, usr, upto):
+    # Marks usr's notifications up to and including nid upto as read
+    conn.execute('''
+        UPDATE inbox SET
+            read_nid = MAX(read_nid, ?),
+            unread = (SELECT COUNT(*) FROM notifications n WHERE n.usr = inbox.usr AND n.nid > MAX(inbox.read_nid, ?))
+        WHERE usr = ?
+    ''', (upto, upto, usr))
+
+
+def trending(conn, limit=10, hours=24, half_life=None, now=None):
+    # [(term, score)] for the hashtags mentioned most in the last 'hours' hours,
+    # read from the hashtag_counts buckets. With half_life (in hours) a mention
+    # counts half as much for every half_life hours it is older than now.
+    # Windows over three days are read from day buckets instead of hour buckets.
+    now = time.time() if now is None else now
+    span = 'hour' if hours <= 72 else 'day'
+    size = schema.SPAN_SECONDS[span]
+    last = int(now // size)
+    first = last - max(1, int(-(-hours * 3600 // size))) + 1
+    scores = {}
+    for bucket, term, cnt in conn.execute('''
+        SELECT bucket, term, cnt FROM hashtag_counts WHERE span = ? AND bucket BETWEEN ? AND ?
+    ''', (span, first, last)):
+        if half_life:
+            cnt *= 0.5 ** ((last - bucket) * size / 3600 / half_life)
+        scores[term] = scores.get(term, 0) + cnt
+    return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
@@ -0,0 +1,998 @@
+"""
+Schema and connection setup for the Twitter clone database.
+
+connect() opens a database with the tuned PRAGMAs and brings its schema up to
+date. Schema changes are numbered migrations; the number of the last one
+applied is kept in PRAGMA user_version, so each runs once per database.
+A Database holds the same settings for opening connections later, or lazily:
+
+    db = Database('twitter.db', read_only=True)
+    conn = db.connect()   # a new connection
+    db.conn               # one shared connection, opened on first use
+
+Maintenance commands:
+   python schema.py migrate <database>            create or upgrade the schema
+   python schema.py rebuild-search <database>     backfill the tweet search index
+   python schema.py rebuild-timeline <database>   turn on and backfill the home timeline table
+   python schema.py disable-timeline <database>   go back to building the feed on read
+   python schema.py check-counters <database>     report (and with --repair fix) drifted counters
+   python schema.py rebuild-trends <database>     recount the trending hashtag buckets
+   python schema.py rebuild-user-search <database>  rebuild the user name/city index
+   python schema.py rebuild-threads <database>    recompute every tweet's thread root and depth
+   python schema.py rebuild-notifications <database>  recompute the notification inboxes
+   python schema.py restore-bulk-load <database>  put back what an interrupted bulk import dropped
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # negative means KiB
+    'busy_timeout': 5000,
+}
+
+TABLES = '''
+CREATE TABLE IF NOT EXISTS users (
+    usr INT,
+    pwd TEXT,
+    name TEXT,
+    email TEXT,
+    city TEXT,
+    timezone FLOAT,
+    PRIMARY KEY (usr)
+);
+
+CREATE TABLE IF NOT EXISTS follows (
+    flwer INT,
+    flwee INT,
+    start_date DATE,
+    PRIMARY KEY (flwer, flwee),
+    FOREIGN KEY (flwer) REFERENCES users,
+    FOREIGN KEY (flwee) REFERENCES users
+);
+
+CREATE TABLE IF NOT EXISTS tweets (
+    tid INT,
+    writer INT,
+    tdate DATE,
+    text TEXT,
+    replyto INT,
+    PRIMARY KEY (tid),
+    FOREIGN KEY (writer) REFERENCES users,
+    FOREIGN KEY (replyto) REFERENCES tweets
+);
+
+CREATE TABLE IF NOT EXISTS hashtags (
+    term TEXT,
+    PRIMARY KEY (term)
+);
+
+CREATE TABLE IF NOT EXISTS mentions (
+    tid INT,
+    term TEXT,
+    PRIMARY KEY (tid, term),
+    FOREIGN KEY (tid) REFERENCES tweets,
+    FOREIGN KEY (term) REFERENCES hashtags
+);
+
+CREATE TABLE IF NOT EXISTS retweets (
+    usr INT,
+    tid INT,
+    rdate DATE,
+    PRIMARY KEY (usr, tid),
+    FOREIGN KEY (usr) REFERENCES users,
+    FOREIGN KEY (tid) REFERENCES tweets
+);
+'''
+# Secondary indexes, one per query path that the primary keys do not serve
+INDEXES = '''
+-- profile recent tweets, more tweets, feed, timeline fan-out on follow
+CREATE INDEX IF NOT EXISTS tweets_writer_idx ON tweets (writer, tdate, tid);
+-- replies to a tweet
+CREATE INDEX IF NOT EXISTS tweets_replyto_idx ON tweets (replyto);
+-- followers of a user, timeline fan-out on write
+CREATE INDEX IF NOT EXISTS follows_flwee_idx ON follows (flwee, flwer);
+-- retweets of a tweet in the feed
+CREATE INDEX IF NOT EXISTS retweets_tid_idx ON retweets (tid, rdate, usr);
+-- tweets mentioning a hashtag
+CREATE INDEX IF NOT EXISTS mentions_term_idx ON mentions (term, tid);
+'''
+
+# users and tweets with usr and tid as AUTOINCREMENT rowid aliases, so new ids are
+# allocated by SQLite inside the INSERT and are never reused after a delete
+ROWID_TABLES = {
+    'users': '''
+        CREATE TABLE users_new (
+            usr INTEGER PRIMARY KEY AUTOINCREMENT,
+            pwd TEXT,
+            name TEXT,
+            email TEXT,
+            city TEXT,
+            timezone FLOAT
+        )
+    ''',
+    'tweets': '''
+        CREATE TABLE tweets_new (
+            tid INTEGER PRIMARY KEY AUTOINCREMENT,
+            writer INT,
+            tdate DATE,
+            text TEXT,
+            replyto INT,
+            FOREIGN KEY (writer) REFERENCES users,
+            FOREIGN KEY (replyto) REFERENCES tweets
+        )
+    ''',
+}
+
+# Full-text index over tweet text and the hashtag terms mentioned by each tweet.
+# The rowid of every row is the tid of the tweet it indexes.
+SEARCH_INDEX = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS tweets_fts USING fts5(text, terms);
+
+CREATE TRIGGER IF NOT EXISTS tweets_fts_ai AFTER INSERT ON tweets BEGIN
+    INSERT INTO tweets_fts (rowid, text, terms) VALUES (new.tid, new.text, '');
+END;
+
+CREATE TRIGGER IF NOT EXISTS tweets_fts_ad AFTER DELETE ON tweets BEGIN
+    DELETE FROM tweets_fts WHERE rowid = old.tid;
+END;
+
+CREATE TRIGGER IF NOT EXISTS tweets_fts_au AFTER UPDATE OF text ON tweets BEGIN
+    UPDATE tweets_fts SET text = new.text WHERE rowid = new.tid;
+END;
+
+CREATE TRIGGER IF NOT EXISTS mentions_fts_ai AFTER INSERT ON mentions BEGIN
+    UPDATE tweets_fts SET terms = trim(terms || ' ' || new.term) WHERE rowid = new.tid;
+END;
+
+CREATE TRIGGER IF NOT EXISTS mentions_fts_ad AFTER DELETE ON mentions BEGIN
+    UPDATE tweets_fts
+    SET terms = (SELECT COALESCE(group_concat(term, ' '), '') FROM mentions WHERE tid = old.tid)
+    WHERE rowid = old.tid;
+END;
+'''
+
+# Materialized home timelines, filled when tweets, retweets and follows are written.
+# Writers listed in timeline_pull have too many followers to fan out to and are
+# merged into the feed on read instead. The feature is on while meta holds a
+# 'timeline_fanout_limit' row.
+TIMELINE = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+
+CREATE TABLE IF NOT EXISTS timeline (
+    usr INT,
+    tdate_ms INT,
+    tid INT,
+    PRIMARY KEY (usr, tdate_ms, tid)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS timeline_pull (
+    usr INT PRIMARY KEY
+);
+'''
+
+DEFAULT_FANOUT_LIMIT = 5000
+
+# Denormalized counters for the profile and tweet statistics views. The
+# archived_* tables hold what archive.py has moved out to archive databases,
+# which the counters keep including.
+COUNTERS = '''
+CREATE TABLE IF NOT EXISTS archived_user_stats (
+    usr INT PRIMARY KEY,
+    tweets INT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS archived_tweet_stats (
+    tid INT PRIMARY KEY,
+    retweets INT NOT NULL DEFAULT 0,
+    replies INT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS user_stats (
+    usr INT PRIMARY KEY,
+    tweets INT NOT NULL DEFAULT 0,
+    followers INT NOT NULL DEFAULT 0,
+    following INT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS tweet_stats (
+    tid INT PRIMARY KEY,
+    retweets INT NOT NULL DEFAULT 0,
+    replies INT NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS tweets_stats_ai AFTER INSERT ON tweets BEGIN
+    INSERT INTO user_stats (usr, tweets) VALUES (new.writer, 1)
+    ON CONFLICT (usr) DO UPDATE SET tweets = tweets + 1;
+    INSERT INTO tweet_stats (tid, replies) SELECT new.replyto, 1 WHERE new.replyto IS NOT NULL
+    ON CONFLICT (tid) DO UPDATE SET replies = replies + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS tweets_stats_ad AFTER DELETE ON tweets BEGIN
+    UPDATE user_stats SET tweets = tweets - 1 WHERE usr = old.writer;
+    UPDATE tweet_stats SET replies = replies - 1 WHERE tid = old.replyto;
+END;
+
+CREATE TRIGGER IF NOT EXISTS follows_stats_ai AFTER INSERT ON follows BEGIN
+    INSERT INTO user_stats (usr, followers) VALUES (new.flwee, 1)
+    ON CONFLICT (usr) DO UPDATE SET followers = followers + 1;
+    INSERT INTO user_stats (usr, following) VALUES (new.flwer, 1)
+    ON CONFLICT (usr) DO UPDATE SET following = following + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS follows_stats_ad AFTER DELETE ON follows BEGIN
+    UPDATE user_stats SET followers = followers - 1 WHERE usr = old.flwee;
+    UPDATE user_stats SET following = following - 1 WHERE usr = old.flwer;
+END;
+
+CREATE TRIGGER IF NOT EXISTS retweets_stats_ai AFTER INSERT ON retweets BEGIN
+    INSERT INTO tweet_stats (tid, retweets) VALUES (new.tid, 1)
+    ON CONFLICT (tid) DO UPDATE SET retweets = retweets + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS retweets_stats_ad AFTER DELETE ON retweets BEGIN
+    UPDATE tweet_stats SET retweets = retweets - 1 WHERE tid = old.tid;
+END;
+'''
+
+# Hashtag mentions counted per hour and per day of the tweet's date, for trending.
+# Buckets are whole hours or days since 1970-01-01.
+TRENDS = '''
+CREATE TABLE IF NOT EXISTS hashtag_counts (
+    span TEXT,
+    bucket INT,
+    term TEXT,
+    cnt INT NOT NULL,
+    PRIMARY KEY (span, bucket, term)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS mentions_trends_ai AFTER INSERT ON mentions BEGIN
+    INSERT INTO hashtag_counts (span, bucket, term, cnt)
+    SELECT 'hour', CAST(strftime('%s', t.tdate) AS INT) / 3600, new.term, 1
+    FROM tweets t WHERE t.tid = new.tid AND strftime('%s', t.tdate) IS NOT NULL
+    ON CONFLICT DO UPDATE SET cnt = cnt + 1;
+    INSERT INTO hashtag_counts (span, bucket, term, cnt)
+    SELECT 'day', CAST(strftime('%s', t.tdate) AS INT) / 86400, new.term, 1
+    FROM tweets t WHERE t.tid = new.tid AND strftime('%s', t.tdate) IS NOT NULL
+    ON CONFLICT DO UPDATE SET cnt = cnt + 1;
+END;
+'''
+
+SPAN_SECONDS = {'hour': 3600, 'day': 86400}
+
+# Trigram index over user names and cities for substring search. It reads the
+# text from the users table itself (external content) and keeps only the index.
+USER_SEARCH = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+    name, city, content='users', content_rowid='usr', tokenize='trigram'
+);
+
+CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN
+    INSERT INTO users_fts (rowid, name, city) VALUES (new.usr, new.name, new.city);
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN
+    INSERT INTO users_fts (users_fts, rowid, name, city) VALUES ('delete', old.usr, old.name, old.city);
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF name, city ON users BEGIN
+    INSERT INTO users_fts (users_fts, rowid, name, city) VALUES ('delete', old.usr, old.name, old.city);
+    INSERT INTO users_fts (rowid, name, city) VALUES (new.usr, new.name, new.city);
+END;
+'''
+
+# Every tweet stores the tid of the first tweet of its conversation (root) and
+# how many replies deep it is, so a whole thread is one range of tweets_root_idx.
+# The columns themselves are added by add_thread_columns().
+THREADS = '''
+CREATE INDEX IF NOT EXISTS tweets_root_idx ON tweets (root, tid);
+
+CREATE TRIGGER IF NOT EXISTS tweets_thread_ai AFTER INSERT ON tweets BEGIN
+    UPDATE tweets SET
+        root = COALESCE((SELECT p.root FROM tweets p WHERE p.tid = new.replyto), new.tid),
+        depth = COALESCE((SELECT p.depth + 1 FROM tweets p WHERE p.tid = new.replyto), 0)
+    WHERE tid = new.tid;
+END;
+'''
+
+# Archive databases that old tweets, retweets and mentions have been moved to,
+# one per period, with the range of tweet dates each holds (first_ms and last_ms
+# since add_epoch_columns). Paths are relative
+# to the main database's directory. meta 'archive_cutoff' is the newest cutoff
+# used; tweets from before it are only in the main database if their thread
+# was still active.
+ARCHIVES = '''
+CREATE TABLE IF NOT EXISTS archives (
+    period TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    first_date DATE,
+    last_date DATE
+);
+'''
+
+# Times as integer milliseconds since 1970-01-01 UTC, which order every paged
+# view. The columns are added by add_epoch_columns(). Every write path still
+# fills the original text column too, as 'YYYY-MM-DD HH:MM:SS' in UTC, for
+# exports and the trend buckets; a row written with only one of the two gets
+# the other from these triggers.
+EPOCH_COLUMNS = {
+    'tweets': ('tdate', 'tdate_ms'),
+    'retweets': ('rdate', 'rdate_ms'),
+    'follows': ('start_date', 'start_ms'),
+}
+
+EPOCH = '''
+-- profile recent tweets, more tweets, feed, timeline fan-out on follow
+CREATE INDEX IF NOT EXISTS tweets_writer_ms_idx ON tweets (writer, tdate_ms, tid);
+-- retweets of a tweet in the feed
+CREATE INDEX IF NOT EXISTS retweets_tid_ms_idx ON retweets (tid, rdate_ms, usr);
+
+CREATE TRIGGER IF NOT EXISTS tweets_epoch_ai AFTER INSERT ON tweets
+WHEN new.tdate_ms IS NULL OR new.tdate IS NULL BEGIN
+    UPDATE tweets SET
+        tdate_ms = COALESCE(tdate_ms, CAST(strftime('%s', tdate) AS INT) * 1000),
+        tdate = COALESCE(tdate, strftime('%Y-%m-%d %H:%M:%S', tdate_ms / 1000, 'unixepoch'))
+    WHERE tid = new.tid;
+END;
+
+CREATE TRIGGER IF NOT EXISTS retweets_epoch_ai AFTER INSERT ON retweets
+WHEN new.rdate_ms IS NULL OR new.rdate IS NULL BEGIN
+    UPDATE retweets SET
+        rdate_ms = COALESCE(rdate_ms, CAST(strftime('%s', rdate) AS INT) * 1000),
+        rdate = COALESCE(rdate, strftime('%Y-%m-%d %H:%M:%S', rdate_ms / 1000, 'unixepoch'))
+    WHERE usr = new.usr AND tid = new.tid;
+END;
+
+CREATE TRIGGER IF NOT EXISTS follows_epoch_ai AFTER INSERT ON follows
+WHEN new.start_ms IS NULL OR new.start_date IS NULL BEGIN
+    UPDATE follows SET
+        start_ms = COALESCE(start_ms, CAST(strftime('%s', start_date) AS INT) * 1000),
+        start_date = COALESCE(start_date, strftime('%Y-%m-%d %H:%M:%S', start_ms / 1000, 'unixepoch'))
+    WHERE flwer = new.flwer AND flwee = new.flwee;
+END;
+'''
+
+# Notifications for replies to, retweets of and follows of a user, written by
+# triggers in the same transaction as the reply, retweet or follow. inbox keeps
+# each user's unread count and the last notification they have read.
+NOTIFICATIONS = '''
+CREATE TABLE IF NOT EXISTS notifications (
+    nid INTEGER PRIMARY KEY,
+    usr INT NOT NULL,
+    kind TEXT NOT NULL,
+    actor INT NOT NULL,
+    tid INT,
+    ndate_ms INT
+);
+
+CREATE INDEX IF NOT EXISTS notifications_usr_idx ON notifications (usr, nid);
+
+CREATE TABLE IF NOT EXISTS inbox (
+    usr INT PRIMARY KEY,
+    unread INT NOT NULL DEFAULT 0,
+    read_nid INT NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS notifications_inbox_ai AFTER INSERT ON notifications BEGIN
+    INSERT INTO inbox (usr, unread) VALUES (new.usr, 1)
+    ON CONFLICT (usr) DO UPDATE SET unread = unread + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS tweets_notify_ai AFTER INSERT ON tweets WHEN new.replyto IS NOT NULL BEGIN
+    INSERT INTO notifications (usr, kind, actor, tid, ndate_ms)
+    SELECT p.writer, 'reply', new.writer, new.tid,
+           COALESCE(new.tdate_ms, CAST(strftime('%s', new.tdate) AS INT) * 1000)
+    FROM tweets p WHERE p.tid = new.replyto AND p.writer <> new.writer;
+END;
+
+CREATE TRIGGER IF NOT EXISTS retweets_notify_ai AFTER INSERT ON retweets BEGIN
+    INSERT INTO notifications (usr, kind, actor, tid, ndate_ms)
+    SELECT t.writer, 'retweet', new.usr, new.tid,
+           COALESCE(new.rdate_ms, CAST(strftime('%s', new.rdate) AS INT) * 1000)
+    FROM tweets t WHERE t.tid = new.tid AND t.writer <> new.usr;
+END;
+
+CREATE TRIGGER IF NOT EXISTS follows_notify_ai AFTER INSERT ON follows WHEN new.flwee <> new.flwer BEGIN
+    INSERT INTO notifications (usr, kind, actor, tid, ndate_ms)
+    VALUES (new.flwee, 'follow', new.flwer, NULL,
+            COALESCE(new.start_ms, CAST(strftime('%s', new.start_date) AS INT) * 1000));
+END;
+'''
+
+# What the notifications table should hold, from the base tables
+ACTUAL_NOTIFICATIONS = '''
+    SELECT p.writer AS usr, 'reply' AS kind, t.writer AS actor, t.tid, t.tdate_ms AS ndate_ms
+    FROM tweets t JOIN tweets p ON p.tid = t.replyto
+    WHERE p.writer <> t.writer
+    UNION ALL
+    SELECT t.writer, 'retweet', r.usr, r.tid, r.rdate_ms
+    FROM retweets r JOIN tweets t ON t.tid = r.tid
+    WHERE t.writer <> r.usr
+    UNION ALL
+    SELECT flwee, 'follow', flwer, NULL, start_ms FROM follows WHERE flwee <> flwer
+'''
+
+# What the counter tables should hold, recomputed from the base tables
+ACTUAL_USER_STATS = '''
+    SELECT usr, SUM(tweets), SUM(followers), SUM(following) FROM (
+        SELECT writer AS usr, COUNT(*) AS tweets, 0 AS followers, 0 AS following FROM tweets GROUP BY writer
+        UNION ALL
+        SELECT flwee, 0, COUNT(*), 0 FROM follows GROUP BY flwee
+        UNION ALL
+        SELECT flwer, 0, 0, COUNT(*) FROM follows GROUP BY flwer
+        UNION ALL
+        SELECT usr, tweets, 0, 0 FROM archived_user_stats
+    )
+    GROUP BY usr
+'''
+
+ACTUAL_TWEET_STATS = '''
+    SELECT tid, SUM(retweets), SUM(replies) FROM (
+        SELECT tid, COUNT(*) AS retweets, 0 AS replies FROM retweets GROUP BY tid
+        UNION ALL
+        SELECT replyto, 0, COUNT(*) FROM tweets WHERE replyto IS NOT NULL GROUP BY replyto
+        UNION ALL
+        SELECT tid, retweets, replies FROM archived_tweet_stats
+    )
+    GROUP BY tid
+'''
+
+
+def run_script(conn, script):
+    # Like executescript(), but runs inside the caller's transaction instead of committing first
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ''
+
+
+def fill_search_index(conn):
+    conn.execute('DELETE FROM tweets_fts')
+    conn.execute('''
+        INSERT INTO tweets_fts (rowid, text, terms)
+        SELECT t.tid, t.text,
+               COALESCE((SELECT group_concat(m.term, ' ') FROM mentions m WHERE m.tid = t.tid), '')
+        FROM tweets t
+    ''')
+    conn.execute("INSERT INTO tweets_fts (tweets_fts) VALUES ('optimize')")
+
+
+def rebuild_search_index(conn):
+    with conn:
+        fill_search_index(conn)
+
+
+def fill_timeline(conn, fanout_limit):
+    conn.execute('DELETE FROM timeline')
+    conn.execute('DELETE FROM timeline_pull')
+    conn.execute('''
+        INSERT INTO timeline_pull (usr)
+        SELECT flwee FROM follows GROUP BY flwee HAVING COUNT(*) >= ?
+    ''', (fanout_limit,))
+    conn.execute('''
+        INSERT OR IGNORE INTO timeline (usr, tdate_ms, tid)
+        SELECT f.flwer, t.tdate_ms, t.tid
+        FROM tweets t
+        JOIN follows f ON t.writer = f.flwee
+        WHERE t.writer NOT IN (SELECT usr FROM timeline_pull)
+    ''')
+    conn.execute('''
+        INSERT OR IGNORE INTO timeline (usr, tdate_ms, tid)
+        SELECT f.flwer, r.rdate_ms, r.tid
+        FROM retweets r
+        JOIN tweets t ON r.tid = t.tid
+        JOIN follows f ON t.writer = f.flwee
+        WHERE t.writer NOT IN (SELECT usr FROM timeline_pull)
+    ''')
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('timeline_fanout_limit', ?)", (fanout_limit,))
+
+
+def rebuild_timeline(conn, fanout_limit=DEFAULT_FANOUT_LIMIT):
+    with conn:
+        fill_timeline(conn, fanout_limit)
+
+
+def disable_timeline(conn):
+    with conn:
+        conn.execute("DELETE FROM meta WHERE key = 'timeline_fanout_limit'")
+        conn.execute('DELETE FROM timeline')
+        conn.execute('DELETE FROM timeline_pull')
+
+
+def fill_epochs(conn):
+    # Fills whichever of each text and millisecond time pair is missing from the other
+    for table, (text_column, ms_column) in EPOCH_COLUMNS.items():
+        conn.execute(f'''
+            UPDATE {table} SET {ms_column} = CAST(strftime('%s', {text_column}) AS INT) * 1000
+            WHERE {ms_column} IS NULL AND {text_column} IS NOT NULL
+        ''')
+        conn.execute(f'''
+            UPDATE {table} SET {text_column} = strftime('%Y-%m-%d %H:%M:%S', {ms_column} / 1000, 'unixepoch')
+            WHERE {text_column} IS NULL AND {ms_column} IS NOT NULL
+        ''')
+
+
+def fill_archive_epochs(conn, db):
+    # Adds and fills the millisecond columns of an archive file written by
+    # archive.py before they existed; safe to re-run
+    for table in ('tweets', 'retweets'):
+        text_column, ms_column = EPOCH_COLUMNS[table]
+        names = [row[1] for row in conn.execute(f'PRAGMA {db}.table_info({table})')]
+        if not names:
+            continue
+        if ms_column not in names:
+            conn.execute(f'ALTER TABLE {db}.{table} ADD COLUMN {ms_column} INT')
+        conn.execute(f'''
+            UPDATE {db}.{table} SET {ms_column} = CAST(strftime('%s', {text_column}) AS INT) * 1000
+            WHERE {ms_column} IS NULL AND {text_column} IS NOT NULL
+        ''')
+    conn.execute(f'DROP INDEX IF EXISTS {db}.tweets_writer_idx')
+    if 'tdate_ms' in [row[1] for row in conn.execute(f'PRAGMA {db}.table_info(tweets)')]:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {db}.tweets_writer_ms_idx ON tweets (writer, tdate_ms, tid)')
+
+
+def fill_counters(conn):
+    conn.execute('DELETE FROM user_stats')
+    conn.execute('DELETE FROM tweet_stats')
+    conn.execute(f'INSERT INTO user_stats (usr, tweets, followers, following) {ACTUAL_USER_STATS}')
+    conn.execute(f'INSERT INTO tweet_stats (tid, retweets, replies) {ACTUAL_TWEET_STATS}')
+
+
+def rebuild_counters(conn):
+    with conn:
+        fill_counters(conn)
+
+
+def fill_trends(conn):
+    conn.execute('DELETE FROM hashtag_counts')
+    conn.execute('''
+        INSERT INTO hashtag_counts (span, bucket, term, cnt)
+        SELECT 'hour', CAST(strftime('%s', t.tdate) AS INT) / 3600 AS hour, m.term, COUNT(*)
+        FROM mentions m JOIN tweets t ON t.tid = m.tid
+        WHERE strftime('%s', t.tdate) IS NOT NULL
+        GROUP BY hour, m.term
+    ''')
+    conn.execute('''
+        INSERT INTO hashtag_counts (span, bucket, term, cnt)
+        SELECT 'day', bucket / 24 AS day, term, SUM(cnt) FROM hashtag_counts
+        WHERE span = 'hour'
+        GROUP BY day, term
+    ''')
+
+
+def rebuild_trends(conn):
+    with conn:
+        fill_trends(conn)
+
+
+def fill_threads(conn):
+    # Walks down from every tweet that is not a reply to a known tweet
+    conn.execute('''
+        WITH RECURSIVE thread (tid, root, depth) AS (
+            SELECT tid, tid, 0 FROM tweets
+            WHERE replyto IS NULL OR replyto NOT IN (SELECT tid FROM tweets)
+            UNION ALL
+            SELECT t.tid, thread.root, thread.depth + 1
+            FROM tweets t JOIN thread ON t.replyto = thread.tid
+        )
+        UPDATE tweets SET root = thread.root, depth = thread.depth
+        FROM thread WHERE thread.tid = tweets.tid
+    ''')
+    # Replies that never lead back to a root (a reply cycle) start their own thread
+    conn.execute('UPDATE tweets SET root = tid, depth = 0 WHERE root IS NULL')
+
+
+def rebuild_threads(conn):
+    with conn:
+        fill_threads(conn)
+
+
+def fill_notifications(conn):
+    # Notification ids are handed out again in date order, so each user's read
+    # position is carried over by the date of the last notification they read,
+    # to the millisecond. Users without an inbox before, e.g. after a bulk
+    # import, start with everything read, as after create_notifications.
+    # Notifications about archived tweets cannot be recomputed from this
+    # database, so they are kept as they are.
+    conn.execute('DROP TABLE IF EXISTS temp.read_upto')
+    conn.execute('''
+        CREATE TEMP TABLE read_upto AS
+        SELECT i.usr, n.ndate_ms FROM inbox i LEFT JOIN notifications n ON n.nid = i.read_nid
+    ''')
+    conn.execute('DROP TABLE IF EXISTS temp.archived_notifications')
+    conn.execute('''
+        CREATE TEMP TABLE archived_notifications AS
+        SELECT usr, kind, actor, tid, ndate_ms FROM notifications
+        WHERE tid IS NOT NULL AND tid NOT IN (SELECT tid FROM tweets)
+    ''')
+    conn.execute('DELETE FROM notifications')
+    conn.execute(f'''
+        INSERT INTO notifications (usr, kind, actor, tid, ndate_ms)
+        SELECT * FROM ({ACTUAL_NOTIFICATIONS} UNION ALL SELECT * FROM temp.archived_notifications) ORDER BY ndate_ms
+    ''')
+    conn.execute('DROP TABLE temp.archived_notifications')
+    conn.execute('DELETE FROM inbox')
+    conn.execute('''
+        INSERT INTO inbox (usr, read_nid, unread)
+        SELECT n.usr,
+               CASE WHEN r.usr IS NULL THEN MAX(n.nid)
+                    ELSE COALESCE(MAX(CASE WHEN n.ndate_ms <= r.ndate_ms THEN n.nid END), 0) END,
+               CASE WHEN r.usr IS NULL THEN 0
+                    ELSE SUM(r.ndate_ms IS NULL OR n.ndate_ms > r.ndate_ms) END
+        FROM notifications n LEFT JOIN temp.read_upto r ON r.usr = n.usr
+        GROUP BY n.usr
+    ''')
+    conn.execute('DROP TABLE temp.read_upto')
+
+
+def rebuild_notifications(conn):
+    with conn:
+        fill_notifications(conn)
+
+
+def fill_user_search(conn):
+    conn.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+
+
+def rebuild_user_search(conn):
+    with conn:
+        fill_user_search(conn)
+
+
+def check_counters(conn):
+    # Returns the ids whose stored counters disagree with the base tables.
+    # Rows of all zeros and missing rows are treated the same.
+    drifted_users = conn.execute(f'''
+        SELECT usr FROM (
+            SELECT * FROM ({ACTUAL_USER_STATS})
+            EXCEPT
+            SELECT * FROM user_stats WHERE tweets OR followers OR following
+        )
+        UNION
+        SELECT usr FROM (
+            SELECT * FROM user_stats WHERE tweets OR followers OR following
+            EXCEPT
+            SELECT * FROM ({ACTUAL_USER_STATS})
+        )
+    ''').fetchall()
+    drifted_tweets = conn.execute(f'''
+        SELECT tid FROM (
+            SELECT * FROM ({ACTUAL_TWEET_STATS})
+            EXCEPT
+            SELECT * FROM tweet_stats WHERE retweets OR replies
+        )
+        UNION
+        SELECT tid FROM (
+            SELECT * FROM tweet_stats WHERE retweets OR replies
+            EXCEPT
+            SELECT * FROM ({ACTUAL_TWEET_STATS})
+        )
+    ''').fetchall()
+    return [row[0] for row in drifted_users], [row[0] for row in drifted_tweets]
+
+
+def drop_indexes_and_triggers(conn, tables):
+    # For bulk loads. What is dropped is kept in meta until
+    # restore_indexes_and_triggers() puts it back, so a load that never
+    # finished can still be undone.
+    rows = conn.execute(f'''
+        SELECT type, name, sql FROM sqlite_master
+        WHERE type IN ('index', 'trigger') AND sql IS NOT NULL
+        AND tbl_name IN ({", ".join("?" * len(tables))})
+    ''', tables).fetchall()
+    for kind, name, sql in rows:
+        conn.execute(f'DROP {kind} "{name}"')
+    conn.execute('''
+        INSERT INTO meta (key, value) VALUES ('bulk_load_restore', ?)
+        ON CONFLICT (key) DO UPDATE SET value = excluded.value
+    ''', (json.dumps(pending_restore(conn) + [list(row) for row in rows]),))
+
+
+def pending_restore(conn):
+    # [(type, name, sql)] a bulk load dropped and has not put back yet
+    row = conn.execute("SELECT value FROM meta WHERE key = 'bulk_load_restore'").fetchone()
+    return json.loads(row[0]) if row else []
+
+
+def restore_indexes_and_triggers(conn):
+    # Recreates what drop_indexes_and_triggers() dropped, unless something has
+    # created it again since, and refills what the triggers would have
+    # maintained; returns the number of objects put back
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('index', 'trigger')")}
+    restore = [sql for kind, name, sql in pending_restore(conn) if name not in existing]
+    for sql in restore:
+        conn.execute(sql)
+    conn.execute("DELETE FROM meta WHERE key = 'bulk_load_restore'")
+    fill_derived(conn)
+    return len(restore)
+
+
+def fill_derived(conn):
+    # Recomputes everything the triggers maintain, after writes that bypassed them
+    fill_epochs(conn)
+    fill_search_index(conn)
+    fill_counters(conn)
+    fill_trends(conn)
+    fill_user_search(conn)
+    fill_threads(conn)
+    fill_notifications(conn)
+    row = conn.execute("SELECT value FROM meta WHERE key = 'timeline_fanout_limit'").fetchone()
+    if row:
+        fill_timeline(conn, row[0])
+
+
+def create_search_index(conn):
+    run_script(conn, SEARCH_INDEX)
+    fill_search_index(conn)
+
+
+def create_counters(conn):
+    run_script(conn, COUNTERS)
+    fill_counters(conn)
+
+
+def create_trends(conn):
+    run_script(conn, TRENDS)
+    fill_trends(conn)
+
+
+def create_user_search(conn):
+    run_script(conn, USER_SEARCH)
+    fill_user_search(conn)
+
+
+def add_thread_columns(conn):
+    names = [row[1] for row in conn.execute('PRAGMA table_info(tweets)')]
+    for column in ('root', 'depth'):
+        if column not in names:
+            conn.execute(f'ALTER TABLE tweets ADD COLUMN {column} INT')
+    run_script(conn, THREADS)
+    fill_threads(conn)
+
+
+def create_archives(conn):
+    # Also creates the archived_* counter tables on databases that had counters already
+    run_script(conn, COUNTERS)
+    run_script(conn, ARCHIVES)
+
+
+def add_epoch_columns(conn):
+    # Text dates were all written in UTC or without a time; both read as UTC here
+    for table, (text_column, ms_column) in EPOCH_COLUMNS.items():
+        if ms_column not in [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {ms_column} INT')
+    fill_epochs(conn)
+    # The millisecond indexes take over from the ones on the text columns
+    conn.execute('DROP INDEX IF EXISTS tweets_writer_idx')
+    conn.execute('DROP INDEX IF EXISTS retweets_tid_idx')
+    run_script(conn, EPOCH)
+    if 'tdate' in [row[1] for row in conn.execute('PRAGMA table_info(timeline)')]:
+        conn.execute('DROP TABLE timeline')
+        run_script(conn, TIMELINE)
+        row = conn.execute("SELECT value FROM meta WHERE key = 'timeline_fanout_limit'").fetchone()
+        if row:
+            fill_timeline(conn, row[0])
+    # The archive registry and cutoff from archive.py, in milliseconds as well
+    if 'first_ms' not in [row[1] for row in conn.execute('PRAGMA table_info(archives)')]:
+        conn.execute('ALTER TABLE archives ADD COLUMN first_ms INT')
+        conn.execute('ALTER TABLE archives ADD COLUMN last_ms INT')
+        conn.execute('''
+            UPDATE archives SET first_ms = CAST(strftime('%s', first_date) AS INT) * 1000,
+                                last_ms = CAST(strftime('%s', last_date) AS INT) * 1000
+        ''')
+    conn.execute('''
+        UPDATE meta SET value = CAST(strftime('%s', value) AS INT) * 1000
+        WHERE key = 'archive_cutoff' AND typeof(value) = 'text'
+    ''')
+    # The archive files as well, each through a connection of its own since
+    # ATTACH is not allowed inside this transaction
+    folder = os.path.dirname([row[2] for row in conn.execute('PRAGMA database_list') if row[1] == 'main'][0])
+    for (path,) in conn.execute('SELECT path FROM archives').fetchall():
+        if os.path.exists(os.path.join(folder, path)):
+            archive = sqlite3.connect(os.path.join(folder, path))
+            try:
+                with archive:
+                    archive.execute('BEGIN IMMEDIATE')
+                    fill_archive_epochs(archive, 'main')
+            finally:
+                archive.close()
+
+
+def create_notifications(conn):
+    # Past replies, retweets and follows are filled in as already read, since
+    # nobody has an inbox yet
+    run_script(conn, NOTIFICATIONS)
+    fill_notifications(conn)
+
+
+def use_rowid_keys(conn):
+    rebuilt = False
+    for table, ddl in ROWID_TABLES.items():
+        columns = conn.execute(f'PRAGMA table_info({table})').fetchall()
+        key_type = [column[2] for column in columns if column[5]][0]
+        if key_type.upper() == 'INTEGER':
+            continue
+        names = ", ".join(column[1] for column in columns)
+        conn.execute(ddl)
+        conn.execute(f'INSERT INTO {table}_new ({names}) SELECT {names} FROM {table}')
+        conn.execute(f'DROP TABLE {table}')
+        conn.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+        rebuilt = True
+    if rebuilt:
+        # Dropping the old tables dropped their indexes and triggers too
+        run_script(conn, SEARCH_INDEX)
+        run_script(conn, COUNTERS)
+        run_script(conn, INDEXES)
+
+
+# Append only: a migration's position in this list is its version number.
+# Each one must be safe to re-run on a database that already has its objects.
+MIGRATIONS = [
+    lambda conn: run_script(conn, TABLES),
+    create_search_index,
+    lambda conn: run_script(conn, TIMELINE),
+    create_counters,
+    lambda conn: run_script(conn, INDEXES),
+    use_rowid_keys,
+    create_trends,
+    create_user_search,
+    add_thread_columns,
+    create_archives,
+    add_epoch_columns,
+    create_notifications,
+]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    # Every migration runs in its own write transaction; taking the write lock
+    # first means concurrent processes apply each migration exactly once.
+    while schema_version(conn) < len(MIGRATIONS):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = schema_version(conn)
+            if version < len(MIGRATIONS):
+                MIGRATIONS[version](conn)
+                conn.execute(f'PRAGMA user_version = {version + 1}')
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+
+def configure(conn, pragmas=PRAGMAS):
+    for name, value in pragmas.items():
+        conn.execute(f'PRAGMA {name} = {value}')
+
+
+def connect(database, **kwargs):
+    conn = sqlite3.connect(database, **kwargs)
+    configure(conn)
+    migrate(conn)
+    return conn
+
+
+class Database:
+    # Where a database is and how to open it. Read-only connections can be
+    # handed between threads, skip journal_mode and never migrate.
+    def __init__(self, path, cached_statements=128, pragmas=PRAGMAS, read_only=False, factory=sqlite3.Connection):
+        self.path = path
+        self.cached_statements = cached_statements
+        self.pragmas = pragmas
+        self.read_only = read_only
+        self.factory = factory
+        self.connect_seconds = None  # how long the last connect() took, migrations included
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def connect(self):
+        started = time.perf_counter()
+        if self.read_only:
+            # A '#' or '?' in the path would otherwise end it early and drop mode=ro
+            uri = pathlib.Path(self.path).resolve().as_uri() + '?mode=ro'
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                                   cached_statements=self.cached_statements, factory=self.factory)
+            configure(conn, {name: value for name, value in self.pragmas.items() if name != 'journal_mode'})
+        else:
+            conn = sqlite3.connect(self.path, cached_statements=self.cached_statements, factory=self.factory)
+            configure(conn, self.pragmas)
+            migrate(conn)
+        self.connect_seconds = time.perf_counter() - started
+        return conn
+
+    @property
+    def conn(self):
+        with self._lock:
+            if self._conn is None:
+                self._conn = self.connect()
+            return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Twitter clone database maintenance")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('migrate', help="create or upgrade the schema").add_argument('database')
+    commands.add_parser('rebuild-search', help="rebuild the tweet full-text index").add_argument('database')
+    rebuild = commands.add_parser('rebuild-timeline', help="enable and backfill the home timeline table")
+    rebuild.add_argument('database')
+    rebuild.add_argument('--fanout-limit', type=int, default=DEFAULT_FANOUT_LIMIT,
+                         help="writers with at least this many followers are merged in on read")
+    commands.add_parser('disable-timeline', help="build the feed on read again").add_argument('database')
+    check = commands.add_parser('check-counters', help="compare the counter tables with the base tables")
+    check.add_argument('database')
+    check.add_argument('--repair', action='store_true', help="rebuild the counters if any have drifted")
+    commands.add_parser('rebuild-trends', help="recount the trending hashtag buckets").add_argument('database')
+    commands.add_parser('rebuild-user-search', help="rebuild the user name/city index").add_argument('database')
+    commands.add_parser('rebuild-threads', help="recompute thread roots and depths").add_argument('database')
+    commands.add_parser('rebuild-notifications', help="recompute notifications and unread counts").add_argument('database')
+    commands.add_parser('restore-bulk-load', help="recreate the indexes and triggers of an interrupted bulk import"
+                        ).add_argument('database')
+    args = parser.parse_args(argv)
+
+    conn = connect(args.database)
+    try:
+        if args.command == 'migrate':
+            print(f"Schema is at version {schema_version(conn)}.")
+        elif args.command == 'rebuild-search':
+            rebuild_search_index(conn)
+            print("Search index rebuilt.")
+        elif args.command == 'rebuild-timeline':
+            rebuild_timeline(conn, args.fanout_limit)
+            print("Timeline rebuilt.")
+        elif args.command == 'disable-timeline':
+            disable_timeline(conn)
+            print("Timeline disabled.")
+        elif args.command == 'check-counters':
+            users, tweets = check_counters(conn)
+            print(f"{len(users)} user counter(s) and {len(tweets)} tweet counter(s) out of step.")
+            if (users or tweets) and args.repair:
+                rebuild_counters(conn)
+                print("Counters rebuilt.")
+        elif args.command == 'rebuild-trends':
+            rebuild_trends(conn)
+            print("Trends rebuilt.")
+        elif args.command == 'rebuild-user-search':
+            rebuild_user_search(conn)
+            print("User search index rebuilt.")
+        elif args.command == 'rebuild-threads':
+            rebuild_threads(conn)
+            print("Threads rebuilt.")
+        elif args.command == 'rebuild-notifications':
+            rebuild_notifications(conn)
+            print("Notifications rebuilt.")
+        elif args.command == 'restore-bulk-load':
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                restored = restore_indexes_and_triggers(conn) if pending_restore(conn) else None
+            if restored is None:
+                print("No interrupted bulk import to restore.")
+            else:
+                print(f"{restored} indexes and triggers restored, derived tables rebuilt.")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+Local HTTP/JSON API for the Twitter clone.
+
+   python server.py <database> [--host 127.0.0.1] [--port 8080] [--readers 8]
+                    [--cache-size 4096] [--cache-ttl 60]
+
+Requests are served on threads. Reads borrow a connection from a pool of
+read-only WAL connections, and all writes go through one WriteQueue, which
+group-commits them on a single writer thread. Many clients can then share one
+SQLite file without writers blocking each other or the readers.
+
+   POST /login            {"user": 1, "password": "..."}  -> {"token": "..."}
+   GET  /feed             ?after_date=...&after_tid=...&limit=5
+   GET  /search           ?q=keywords&after_date=...&after_tid=...&limit=5
+   GET  /users/<usr>
+   GET  /tweets/<tid>/stats
+   GET  /tweets/<tid>/thread
+   GET  /trending         ?hours=24&half_life=6&limit=10
+   GET  /cache            read cache hit/miss/eviction counters
+   POST /tweets           {"text": "...", "replyto": null}  -> {"tid": ...}
+   POST /follow           {"user": 2}
+   POST /retweet          {"tid": 7}
+   GET  /recommend        ?limit=10   who to follow
+   GET  /notifications    ?after=<nid>&limit=5
+   POST /notifications/read  {"upto": <nid>}
+
+Only feed, recommend, notifications, post, follow and retweet need an
+'Authorization: Bearer <token>' header. Dates are milliseconds since
+1970-01-01 UTC. Feed and search responses carry a "next" [date, tid] pair to
+send back as after_date/after_tid. Search and
+thread also read the archive databases made by archive.py.
+"""
+
+import argparse
+import contextlib
+import functools
+import json
+import queue
+import re
+import secrets
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import archive
+import batch
+import cache
+import graph
+import queries
+import schema
+from writequeue import WriteQueue
+
+WRITE_TIMEOUT = 10
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def connect_read_only(database):
+    return schema.Database(database, batch.CACHED_STATEMENTS, read_only=True).connect()
+
+
+class ReaderPool:
+    # Read-only connections handed out to one request at a time
+    def __init__(self, database, size):
+        self._idle = queue.Queue()
+        for _ in range(size):
+            self._idle.put(connect_read_only(database))
+        self.size = size
+
+    @contextlib.contextmanager
+    def connection(self):
+        conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def close(self):
+        for _ in range(self.size):
+            self._idle.get().close()
+
+
+class App:
+    def __init__(self, database, readers=8, cache_size=4096, cache_ttl=60.0):
+        # The write queue connects first, so the schema is migrated before readers open
+        self.writes = WriteQueue(database)
+        self.readers = ReaderPool(database, readers)
+        # The cache watches its own connection for commits by other processes
+        self._watch = connect_read_only(database)
+        self.cache = cache.ReadCache(self._watch, cache_size, cache_ttl)
+        with self.readers.connection() as conn:
+            self.graph = graph.load_or_build(conn, graph.snapshot_path(database))
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.writes.close()
+        self.readers.close()
+        self._watch.close()
+
+    def login(self, body):
+        with self.readers.connection() as conn:
+            account = conn.execute('SELECT usr FROM users WHERE usr = ? AND pwd = ?',
+                                   (int(field(body, 'user')), str(field(body, 'password')))).fetchone()
+        if not account:
+            raise HTTPError(401, "invalid login credentials")
+        token = secrets.token_urlsafe(24)
+        with self._lock:
+            self._sessions[token] = account[0]
+        return {'token': token, 'user': account[0]}
+
+    def user_for(self, headers):
+        token = (headers.get('Authorization') or '').removeprefix('Bearer ').strip()
+        with self._lock:
+            usr = self._sessions.get(token)
+        if usr is None:
+            raise HTTPError(401, "log in first")
+        return usr
+
+    def read(self, handler, command):
+        with self.readers.connection() as conn:
+            return handler(conn, command)
+
+    def write(self, future, invalidate, *args):
+        # Cached entries are dropped once the write has committed
+        result = future.result(timeout=WRITE_TIMEOUT)
+        invalidate(*args)
+        self.cache.ack()
+        return result
+
+
+def recommend(app, conn, usr, limit):
+    app.graph.refresh(conn)
+    suggestions = app.graph.recommend(usr, limit)
+    names = queries.user_names(conn, [candidate for candidate, mutual in suggestions])
+    return {'users': [{'user': candidate, 'name': names.get(candidate), 'mutual': mutual,
+                       'followers': app.graph.follower_count(candidate)} for candidate, mutual in suggestions]}
+
+
+def field(body, name):
+    # A missing field is a bad request, not a KeyError that would read as 404
+    if body.get(name) is None:
+        raise HTTPError(400, f"missing {name!r} in request body")
+    return body[name]
+
+
+def limit_arg(params, default):
+    # Between 1 and 100; SQLite would read a negative limit as none at all
+    return max(1, min(int(params.get('limit', default)), 100))
+
+
+def page_args(params):
+    command = {'limit': limit_arg(params, 5)}
+    if 'after_date' in params and 'after_tid' in params:
+        command['after'] = (int(params['after_date']), int(params['after_tid']))
+    return command
+
+
+def route(app, method, path, params, body, headers):
+    if method == 'POST' and path == '/login':
+        return app.login(body)
+    if method == 'GET' and path == '/feed':
+        return app.read(batch.feed, {'user': app.user_for(headers), **page_args(params)})
+    if method == 'GET' and path == '/search':
+        return app.read(functools.partial(batch.search, reads=archive), {'keywords': params.get('q', ''), **page_args(params)})
+    match = re.fullmatch(r'/users/(\d+)', path)
+    if method == 'GET' and match:
+        return app.read(functools.partial(batch.profile, reads=app.cache), {'user': int(match.group(1))})
+    match = re.fullmatch(r'/tweets/(\d+)/stats', path)
+    if method == 'GET' and match:
+        return app.read(functools.partial(batch.stats, reads=app.cache), {'tid': int(match.group(1))})
+    match = re.fullmatch(r'/tweets/(\d+)/thread', path)
+    if method == 'GET' and match:
+        return app.read(functools.partial(batch.thread, reads=archive), {'tid': int(match.group(1))})
+    if method == 'GET' and path == '/recommend':
+        usr, limit = app.user_for(headers), limit_arg(params, 10)
+        with app.readers.connection() as conn:
+            return recommend(app, conn, usr, limit)
+    if method == 'GET' and path == '/trending':
+        command = {'limit': limit_arg(params, 10), 'hours': float(params.get('hours', 24))}
+        if 'half_life' in params:
+            command['half_life'] = float(params['half_life'])
+        return app.read(batch.trending, command)
+    if method == 'GET' and path == '/notifications':
+        command = {'user': app.user_for(headers), 'limit': limit_arg(params, 5)}
+        if 'after' in params:
+            command['after'] = int(params['after'])
+        return app.read(batch.notifications, command)
+    if method == 'POST' and path == '/notifications/read':
+        app.writes.mark_notifications_read(app.user_for(headers), int(field(body, 'upto'))).result(timeout=WRITE_TIMEOUT)
+        return {}
+    if method == 'GET' and path == '/cache':
+        return app.cache.stats()
+    if method == 'POST' and path == '/tweets':
+        usr, replyto = app.user_for(headers), body.get('replyto')
+        if replyto is not None:
+            replyto = int(replyto)
+        future = app.writes.post_tweet(usr, str(field(body, 'text')), replyto)
+        return {'tid': app.write(future, app.cache.on_tweet, usr, replyto)}
+    if method == 'POST' and path == '/follow':
+        usr, flwee = app.user_for(headers), int(field(body, 'user'))
+        app.write(app.writes.follow(usr, flwee), app.cache.on_follow, usr, flwee)
+        app.graph.add(usr, flwee)
+        return {}
+    if method == 'POST' and path == '/retweet':
+        usr, tid = app.user_for(headers), int(field(body, 'tid'))
+        app.write(app.writes.retweet(usr, tid), app.cache.on_retweet, usr, tid)
+        return {}
+    raise HTTPError(404, f"no route for {method} {path}")
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def handle_request(self, method):
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}') if length else {}
+            if not isinstance(body, dict):
+                raise HTTPError(400, "request body must be a JSON object")
+            status, result = 200, route(self.server.app, method, url.path, params, body, self.headers)
+        except HTTPError as e:
+            status, result = e.status, {'error': str(e)}
+        except TimeoutError:
+            # The write may still commit once the queue catches up
+            status, result = 503, {'error': f"write not committed within {WRITE_TIMEOUT} s"}
+        except LookupError as e:
+            status, result = 404, {'error': str(e)}
+        except sqlite3.IntegrityError as e:
+            status, result = 409, {'error': str(e)}
+        except (sqlite3.ProgrammingError, sqlite3.InterfaceError) as e:
+            # Parameters of a type SQLite cannot bind, e.g. a JSON object
+            status, result = 400, {'error': str(e)}
+        except (ValueError, TypeError, OverflowError) as e:
+            status, result = 400, {'error': str(e)}
+        except Exception as e:
+            status, result = 500, {'error': f"{type(e).__name__}: {e}"}
+        payload = json.dumps(result).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, address, app):
+        super().__init__(address, Handler)
+        self.app = app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the Twitter clone over HTTP/JSON")
+    parser.add_argument('database')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--readers', type=int, default=8, help="read-only connections in the pool")
+    parser.add_argument('--cache-size', type=int, default=4096, help="cached profiles and tweet stats")
+    parser.add_argument('--cache-ttl', type=float, default=60.0, help="seconds before a cache entry expires")
+    args = parser.parse_args(argv)
+
+    app = App(args.database, args.readers, args.cache_size, args.cache_ttl)
+    server = Server((args.host, args.port), app)
+    print(f"Serving {args.database} on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        app.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Group commit for writes coming from many threads.
+
+A WriteQueue owns the only writing connection. Callers submit write functions
+from any thread and get a Future back; the writer thread collects whatever has
+arrived within a few milliseconds (or up to max_batch writes), runs the batch
+in one transaction and commits once, so throughput is set by the batch size
+rather than by fsync latency. Each write runs under its own savepoint, so one
+failing write does not undo the rest of its batch.
+
+    writes = WriteQueue('twitter.db')
+    tid = writes.post_tweet(1, 'hello #world').result()
+    writes.close()
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import queries
+import schema
+
+_STOP = object()
+
+
+class WriteQueue:
+    def __init__(self, database, max_batch=500, max_delay=0.003, connect=schema.connect):
+        self.database = database
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.connect = connect
+        self.batches = 0
+        self.writes = 0
+        self._queue = queue.Queue()
+        self._ready = Future()
+        self._thread = threading.Thread(target=self._run, name='write-queue', daemon=True)
+        self._thread.start()
+        # Surface connection or migration errors to the caller
+        self._ready.result()
+
+    def submit(self, write, *args):
+        # write(conn, *args) runs on the writer thread; the Future resolves
+        # with its return value once the batch holding it has committed
+        future = Future()
+        self._queue.put((write, args, future))
+        return future
+
+    def post_tweet(self, writer, text, replyto=None):
+        return self.submit(queries.post_tweet, writer, text, replyto)
+
+    def retweet(self, usr, tid):
+        return self.submit(queries.retweet, usr, tid)
+
+    def follow(self, flwer, flwee):
+        return self.submit(queries.follow, flwer, flwee)
+
+    def mark_notifications_read(self, usr, upto):
+        return self.submit(queries.mark_notifications_read, usr, upto)
+
+    def close(self):
+        # Writes already submitted are committed before the thread exits
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch and batch[-1] is not _STOP:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        try:
+            conn = self.connect(self.database)
+        except BaseException as e:
+            self._ready.set_exception(e)
+            return
+        self._ready.set_result(None)
+        try:
+            while True:
+                batch = self._next_batch()
+                stop = batch[-1] is _STOP
+                if stop:
+                    batch.pop()
+                if batch:
+                    self._commit(conn, batch)
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _commit(self, conn, batch):
+        results = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for write, args, future in batch:
+                conn.execute('SAVEPOINT write')
+                try:
+                    results.append((future, write(conn, *args), None))
+                except Exception as e:
+                    conn.execute('ROLLBACK TO write')
+                    results.append((future, None, e))
+                conn.execute('RELEASE write')
+            conn.commit()
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            for write, args, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.writes += len(batch)
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)